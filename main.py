@@ -1,23 +1,38 @@
 import time
 
-from scripts.cbsim import OSM_download, net, net_draw, node, stochastic, common, vehicles, CVRP, co2
+from scripts.cbsim import OSM_download, net, net_draw, node, stochastic, common, vehicles, CVRP, co2, sdm
 from datetime import datetime
 from pathlib import Path
 import multiprocessing as mp
 import os
 
+from scripts.cbsim.experiment import SequentialStopping
 
-def listener(q):
+
+def listener(q, stop=None, stopping=None):
     counter = 0
+    failed = 0  # replications without a CVRP solution
     while True:
         message = q.get()
 
         # print(f"got: {message}")
         if message == "kill":
-            print("kill")
+            print(f"kill ({counter} replications, {failed} without a solution)")
             break
+        if message[0] == "failed":
+            # ("failed", thread, vehicle type): recorded, not in the sample
+            failed += 1
+            _, thread, kind = message
+            failed_path = absolute_folder_path + '/' + "failed.csv"
+            if not (os.path.isfile(failed_path)):
+                with open(failed_path, 'w') as f:
+                    f.write("datetime;thread;vehicles\n")
+            with open(failed_path, 'a') as f:
+                f.write(f"{datetime.now().strftime('%Y_%m_%d_%H_%M_%S_%s')};{thread};{kind}\n")
+            print(f"T{thread}: no {kind} solution, {failed} replications failed so far")
+            continue
         counter += 1
-        N, bike_routes, bike_distances, min_bike_distance, bike_count, van_routes, van_distances, min_van_distance, van_count, van_emissions = message
+        N, bike_routes, bike_distances, min_bike_distance, bike_count, van_routes, van_distances, min_van_distance, van_count, van_emissions, sample = message
 
         now = datetime.now()
         dtString = now.strftime("%Y_%m_%d_%H_%M_%S_%s")
@@ -36,46 +51,52 @@ def listener(q):
         common.save_results(common_path + "_bike_routes.pkl", bike_routes)
         common.save_results(common_path + "_van_routes.pkl", van_routes)
 
+        # sample - metrics of the replication (of the antithetic pair, None for its first half)
+        if stopping is not None and sample is not None and not stop.is_set():
+            if stopping.add(**sample):
+                print(f"Confidence target reached after {stopping.size} samples: {stopping.stats()}")
+                stop.set()
+
 
-def experiment(N, thread, q, experiment_count, timeout):
+def experiment(N, thread, q, experiment_count, timeout, stream=None, antithetic=False, stop=None):
     N.thread = thread
+    # independent demand stream per replication (antithetic: per pair of replications)
+    replications = stream.spawn(experiment_count) if stream is not None else [None] * experiment_count
+    pair = []  # metrics of the antithetic pair, averaged into one sample of the stopping rule
 
     for interator in range(experiment_count):
-        N.demand = []
-        N.gen_requests(sender=lpoints[0], nodes=N.nodes, probs=probs, s_weight=s_weight, s_dimensions=s_dimensions)
+        if stop is not None and stop.is_set():
+            break  # the confidence target is reached
+        if not antithetic or interator % 2 == 0:
+            pair = []
+            scenarios = N.gen_scenarios(sender=lpoints[0], nodes=N.nodes, probs=probs, s_weight=s_weight,
+                                        s_dimensions=s_dimensions, k=2 if antithetic else 1,
+                                        rng=replications[interator], antithetic=antithetic, crn=True)
+        N.demand = scenarios.batch(interator % 2 if antithetic else 0)
+        print(f"T{thread}: {len(N.demand)} requests generated")
         print(f"T{thread}: bike:")
-        min_bike_distance = -1
 
+        # the fleet is sized by the bin packing of the demand (see CVRP.solve)
         N.vehicles = N.bikes
-        while min_bike_distance == -1:
-            bike_routes, bike_distances, N = CVRP.solve(N, timeout=timeout)
-            bike_total_distances = CVRP.calculate_total_distances(bike_distances)
-            try:
-                min_bike_distance = min(bike_total_distances)
-            except ValueError:
-                min_bike_distance = -1
-                N.vehicles.count = N.vehicles.count + 1
-                print(f"T{thread}: adding bike {N.vehicles.count}")
-
+        bike_routes, bike_distances, N = CVRP.solve(N, timeout=timeout)
+        bike_total_distances = CVRP.calculate_total_distances(bike_distances)
+        if len(bike_total_distances) == 0:
+            q.put(("failed", thread, "bike"))
+            continue
+        min_bike_distance = min(bike_total_distances)
         index = bike_total_distances.index(min_bike_distance)
 
         bike_count = len(bike_routes[index])
         print(f"T{thread}: best total bike distance: {min_bike_distance}\n")
 
         print(f"T{thread}: van:")
-        min_van_distance = -1
         N.vehicles = N.vans
-        while min_van_distance == -1:
-            van_routes, van_distances, N = CVRP.solve(N, timeout=timeout)
-            van_total_distances = CVRP.calculate_total_distances(van_distances)
-
-            try:
-                min_van_distance = min(van_total_distances)
-            except ValueError:
-                min_van_distance = -1
-                N.vehicles.count = N.vehicles.count + 1
-                print(f"T{thread}: adding van {N.vehicles.count}")
-
+        van_routes, van_distances, N = CVRP.solve(N, timeout=timeout)
+        van_total_distances = CVRP.calculate_total_distances(van_distances)
+        if len(van_total_distances) == 0:
+            q.put(("failed", thread, "van"))
+            continue
+        min_van_distance = min(van_total_distances)
         index = van_total_distances.index(min_van_distance)
 
         van_count = len(van_routes[index])
@@ -84,7 +105,15 @@ def experiment(N, thread, q, experiment_count, timeout):
 
         van_emissions = co2.calc_co2(van_count, min_van_distance / 1000, co2.cons, co2.em_fs, params=[0, 100])
 
-        result = N, bike_routes, bike_distances, min_bike_distance, bike_count, van_routes, van_distances, min_van_distance, van_count, van_emissions
+        sample = {'saved_distance': min_van_distance - min_bike_distance, 'van_emissions': van_emissions}
+        if antithetic:
+            # the halves of the pair are negatively correlated, only their mean is an independent sample
+            pair.append(sample)
+            sample = None
+            if len(pair) == 2:
+                sample = {m: (pair[0][m] + pair[1][m]) / 2 for m in pair[0]}
+
+        result = N, bike_routes, bike_distances, min_bike_distance, bike_count, van_routes, van_distances, min_van_distance, van_count, van_emissions, sample
         q.put(result)
 
 
@@ -95,7 +124,7 @@ if __name__ == "__main__":
     if n.bbox is None and n.polygon is None:
         n = net_draw.create_bounding_polygon(n)
 
-    n = OSM_download.generate_network_and_businesses(n)
+    n = OSM_download.generate_network_and_businesses(n, cache=sdm.SDMCache('results/sdm_cache'))
 
     if len([node for node in n.nodes if node.type == 'L']) == 0:
         n = net_draw.select_loading_point(n)
@@ -113,8 +142,15 @@ if __name__ == "__main__":
     dimensionsLocation = 0  # mm
     dimensionsScale = 400
 
-    experiment_per_thread = 5
+    experiment_per_thread = 50  # upper bound, the experiments stop once the confidence target is reached
     timeout = 10
+    # relative half-width of the confidence intervals of the saved distance and van emissions
+    target_error = 0.05
+    min_experiments = 10
+    # the same seed gives the same demand to the same thread and replication
+    # for any parameters (common random numbers); None - a fresh seed
+    seed = 2024
+    antithetic = False  # replications 2i and 2i+1 get the antithetic demand
 
     s_weight = stochastic.Stochastic(law=weightLaw, location=weightLocation, scale=weightScale)
     s_dimensions = stochastic.Stochastic(law=dimensionsLaw, location=dimensionsLocation, scale=dimensionsScale)
@@ -137,11 +173,17 @@ if __name__ == "__main__":
 
     pool = mp.Pool(mp.cpu_count() + 2)
 
-    watcher = pool.apply_async(listener, (q,))
+    stop = manager.Event()
+    stopping = SequentialStopping(('saved_distance', 'van_emissions'), error=target_error, min_size=min_experiments)
+    watcher = pool.apply_async(listener, (q, stop, stopping))
+
+    streams = stochastic.seed_streams(seed, mp.cpu_count())
+    print(f"Seed: {streams[0].entropy}")
 
     jobs = []
     for i in range(mp.cpu_count()):
-        job = pool.apply_async(experiment, args=(n, i, q, experiment_per_thread, timeout))
+        job = pool.apply_async(experiment, args=(n, i, q, experiment_per_thread, timeout, streams[i], antithetic,
+                                                  stop))
         jobs.append(job)
 
     for job in jobs:
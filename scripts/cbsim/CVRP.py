@@ -1,243 +1,386 @@
-from ortools.constraint_solver import routing_enums_pb2, pywrapcp
-from ortools.constraint_solver.pywrapcp import SolutionCollector
-
-from scripts.cbsim import net
-from math import ceil
-import numpy as np
-
-
-# TODO consider moving vehicle count calculation to net.py
-def prepare_data(n: net.Net):
-    #   Calculate how many routes are needed to fulfill the demand
-    sum_weights = 0
-    sum_volumes = 0
-
-    for single_demand in n.demand:
-        sum_weights += single_demand.weight
-        sum_volumes += single_demand.volume
-
-    vehicle_count_weight = sum_weights / n.vehicles.capacity
-    vehicle_count_volume = sum_volumes / n.vehicles.cargo_volume
-
-    # TODO change to max()
-    if n.vehicles.count == 0:
-        if vehicle_count_weight >= vehicle_count_volume:
-            n.vehicles.count = ceil(vehicle_count_weight)
-        else:
-            n.vehicles.count = ceil(vehicle_count_volume)
-
-    n.vehicles.capacities = []
-    n.vehicles.volumes = []
-    for i in range(n.vehicles.count):
-        n.vehicles.capacities.append(n.vehicles.capacity)
-        n.vehicles.volumes.append(n.vehicles.cargo_volume)
-
-    #   generate SDM for routing problem
-    lpoints = [node for node in n.nodes if node.type == 'L']
-    sender = lpoints[0]
-    destinations_nid = []
-    destinations_nid.append(sender.closest_itsc.nid)
-    for i in range(len(n.demand)):
-        destinations_nid.append(n.demand[i].destination.closest_itsc.nid)
-
-    requests_sdm = np.zeros((len(destinations_nid), len(destinations_nid)), dtype=int)
-
-    for sdm_i, from_node_id in enumerate(destinations_nid):
-        for sdm_j, to_node_id in enumerate(destinations_nid):
-            requests_sdm[sdm_i, sdm_j] = round(n.sdm[from_node_id][to_node_id] * 1000)
-
-    # for i in range(len(requests_sdm)):
-    #     for j in range(len(requests_sdm)):
-    #         if i == j:
-    #             requests_sdm[i][j] = 0
-    #         else:
-    #             from_node_id = n.demand[i - 1].destination.closest_itsc.nid
-    #             to_node_id = n.demand[j - 1].destination.closest_itsc.nid
-    #             value = n.sdm[from_node_id][to_node_id]*1000
-    #             requests_sdm[i][j] = round(n.sdm[from_node_id][to_node_id]*1000)
-
-    data = {}
-    data['num_vehicles'] = n.vehicles.count
-    data['vehicle_capacities'] = n.vehicles.capacities
-    data['cargo_volume'] = n.vehicles.cargo_volume
-    data['vehicle_load'] = []
-    data['depotID'] = 0
-    for i in range(0, data['num_vehicles']):
-        data['vehicle_load'].append(0)
-
-    print(f"T: {n.thread} Number of vehicles: {data['num_vehicles']}")
-
-    orders = {
-        "ID": [0],  # 0 is the depot
-        "weight": [0],  # g
-        "width": [0],
-        "length": [0],  # mm
-        "height": [0],
-        "volume": [0]
-    }
-
-    for ID, singleOrder in enumerate(n.demand):
-        orders['ID'].append(singleOrder.destination.closest_itsc.nid)
-        orders['weight'].append(singleOrder.weight)
-        orders['width'].append(singleOrder.width)
-        orders['length'].append(singleOrder.length)
-        orders['height'].append(singleOrder.height)
-        orders['volume'].append(singleOrder.volume)
-
-    return data, orders, requests_sdm, n
-
-
-def solve(n: net.Net, timeout):
-    data, orders, distance_matrix, n = prepare_data(n)
-    manager = pywrapcp.RoutingIndexManager(len(distance_matrix), data['num_vehicles'], data['depotID'])
-
-    routing = pywrapcp.RoutingModel(manager)
-
-    # Create and register a transit callback.
-    def distance_callback(from_index, to_index):
-        """Returns the distance between the two nodes."""
-        # Convert from routing variable Index to distance matrix NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return distance_matrix[from_node][to_node]
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-
-    # Define distance of each arc.
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-    # volume constraints
-    def volume_callback(from_index):
-        from_node = manager.IndexToNode(from_index)
-        return orders['volume'][from_node]
-
-    # volume constraint
-    volume_callback_index = routing.RegisterUnaryTransitCallback(volume_callback)
-
-    routing.AddDimension(
-        volume_callback_index,
-        0,  # null capacity slack
-        data['cargo_volume'],  # vehicle maximum capacities
-        True,  # start cumul to zero
-        'Volume')
-
-    # weight constraints
-    def demand_callback(from_index):
-        from_node = manager.IndexToNode(from_index)
-        return orders['weight'][from_node]
-
-    demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
-
-    routing.AddDimensionWithVehicleCapacity(
-        demand_callback_index,
-        0,  # null capacity slack
-        data['vehicle_capacities'],  # vehicle maximum capacities
-        True,  # start cumul to zero
-        'Capacity')
-
-    dimension_name = 'Distance'
-    routing.AddDimension(
-        transit_callback_index,
-        0,  # no slack
-        999999,  # vehicle maximum travel distance
-        True,  # start cumul to zero
-        dimension_name)
-    distance_dimension = routing.GetDimensionOrDie(dimension_name)
-    distance_dimension.SetGlobalSpanCostCoefficient(100)
-
-    # Setting first solution heuristic.
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-    search_parameters.local_search_metaheuristic = (routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
-    search_parameters.solution_limit = 1
-    search_parameters.time_limit.FromSeconds(timeout)
-    search_parameters.use_full_propagation = 1
-
-    # Solve the problem.
-
-    assignment = routing.SolveWithParameters(search_parameters)
-    collector = initialize_collector(data, manager, routing, distance_matrix)
-
-    search_parameters.solution_limit = 2 ** 24
-    search_parameters.time_limit.FromSeconds(timeout)
-
-    routing.SolveFromAssignmentWithParameters(assignment, search_parameters)
-
-    routes = []
-    distances = []
-
-    # Print solution on console.
-    if assignment:
-
-        print('CVRP feasible solutions: {}'.format(collector.SolutionCount()))
-        for i in range(collector.SolutionCount()):
-            temp_route, temp_distance = list_solution(data,
-                                                      manager,
-                                                      routing,
-                                                      collector.Solution(i),
-                                                      i,
-                                                      distance_matrix)
-
-            routes.append(temp_route)
-            distances.append(temp_distance)
-    else:
-        print("No solutions")
-
-    return routes, distances, n
-
-
-def initialize_collector(data, manager, routing, distance_matrix):
-    collector: SolutionCollector = routing.solver().AllSolutionCollector()
-    collector.AddObjective(routing.CostVar())
-
-    routing.AddSearchMonitor(collector)
-
-    for node in range(len(distance_matrix)):
-        collector.Add(routing.NextVar(manager.NodeToIndex(node)))
-
-    for v in range(data['num_vehicles']):
-        collector.Add(routing.NextVar(routing.Start(v)))
-
-    return collector
-
-
-def list_solution(data, manager, routing, solution, i, distance_matrix):
-    routes = []
-    distances = []
-
-    total_distance = 0
-    max_route_distance = 0
-
-    for vehicle_id in range(data['num_vehicles']):
-        tempsolution = []
-        index = routing.Start(vehicle_id)
-
-        route_distance = 0
-        route = []
-        distance = []
-        previous_index = 0
-        while not routing.IsEnd(index):
-            node_index = manager.IndexToNode(index)
-            # print('INDEX {}'.format(node_index))
-            # print('PREV_INDEX {}'.format(previous_index))
-            route.append(node_index)
-            # print(distance_matrix[previous_index][node_index])
-            distance.append(distance_matrix[previous_index][node_index])
-            previous_index = node_index
-            index = solution.Value(routing.NextVar(index))
-
-        route.append(data['depotID'])
-        distance.append(distance_matrix[previous_index][data['depotID']])
-        routes.append(route)
-        distances.append(distance)
-
-    return routes, distances
-
-def calculate_total_distances(routes):
-    total_distances = []
-    for route in routes:
-        single_total_distance = 0
-        for vehicle in route:
-            single_total_distance += sum(vehicle)
-        total_distances.append(single_total_distance)
+from ortools.constraint_solver import routing_enums_pb2, pywrapcp
+from ortools.constraint_solver.pywrapcp import SolutionCollector
+
+from scripts.cbsim import fleet, net
+from scripts.cbsim.demand import DemandBatch
+import heapq
+import numpy as np
+
+
+def aggregate_requests(demand, capacity, cargo_volume):
+    '''
+        Merges the requests with the same closest intersection into routing nodes;
+        the merged node is split (next fit) when it exceeds the capacity or volume
+        Returns the positions of the requests ordered by the routing nodes
+        and the starts of the nodes in that order
+    '''
+    itsc, weight, volume = demand.data['closest_itsc'], demand.data['weight'], demand.data['volume']
+    order = np.argsort(itsc, kind='stable')
+    if len(order) == 0:
+        return order, np.zeros(0, dtype=np.int64)
+    groups = np.concatenate(([0], np.flatnonzero(np.diff(itsc[order]) != 0) + 1))
+    fits = ((np.add.reduceat(weight[order], groups) <= capacity) &
+            (np.add.reduceat(volume[order], groups) <= cargo_volume))
+    starts = []
+    for g, start in enumerate(groups):
+        starts.append(start)
+        if fits[g]:
+            continue
+        stop = groups[g + 1] if g + 1 < len(groups) else len(order)
+        w, v = 0, 0
+        for k in range(start, stop):
+            w, v = w + weight[order[k]], v + volume[order[k]]
+            if k > start and (w > capacity or v > cargo_volume):
+                starts.append(k)
+                w, v = weight[order[k]], volume[order[k]]
+    return order, np.array(starts, dtype=np.int64)
+
+
+def prepare_orders(n: net.Net, fill=1.0):
+    '''
+        Distance matrix [m] and order columns (arrays) of the depot and the routing nodes
+        (co-located requests merged, see aggregate_requests); orders['requests'] - positions
+        of the requests of every node. Cached in n.prepared for the current demand set,
+        distances (n.sdm, n.ch), loading point and the vehicle limits
+        (reused when the same demand is solved again)
+        fill - part of the vehicle capacity and volume a merged node may take
+        (smaller nodes are easier to pack for a tight fleet; 0 - no merging)
+    '''
+    limits = (fill * n.vehicles.capacity, fill * n.vehicles.cargo_volume)
+    lpoints = [node for node in n.nodes if node.type == 'L']
+    sender = lpoints[0]
+    cached = n.prepared
+    # the objects themselves are kept (and compared by identity) while the cache is valid
+    if (cached is None or cached['demand'] is not n.demand or cached['size'] != len(n.demand) or
+            cached['sdm'] is not n.sdm or cached['ch'] is not n.ch or cached['sender'] is not sender or
+            cached['depot'] != sender.closest_itsc.nid):
+        demand = n.demand if isinstance(n.demand, DemandBatch) else DemandBatch.from_requests(n.demand)
+        cached = n.prepared = {'demand': n.demand, 'size': len(n.demand), 'sdm': n.sdm, 'ch': n.ch,
+                               'sender': sender, 'depot': sender.closest_itsc.nid, 'batch': demand, 'problems': {}}
+    demand = cached['batch']
+    if limits in cached['problems']:
+        return (demand,) + cached['problems'][limits]
+
+    order, starts = aggregate_requests(demand, *limits)
+    nodes = demand.data[order[starts]] if len(starts) > 0 else demand.data[:0]
+
+    #   generate SDM for routing problem
+    destinations_nid = np.concatenate(([sender.closest_itsc.nid], nodes['closest_itsc']))
+
+    if n.ch is not None:
+        # point-to-point distances by the contraction hierarchy (no full SDM needed)
+        distances = n.ch.many_to_many(destinations_nid, destinations_nid)
+    else:
+        distances = n.sdm_block(destinations_nid, destinations_nid)
+    requests_sdm = np.rint(distances * 1000).astype(np.int64)
+
+    orders = {'ID': np.concatenate(([0], nodes['closest_itsc']))}  # 0 is the depot
+    for field, reduce in (('weight', np.add), ('volume', np.add),  # g, mm
+                          ('width', np.maximum), ('length', np.maximum), ('height', np.maximum)):  # largest parcel
+        values = reduce.reduceat(demand.data[field][order], starts) if len(starts) > 0 else np.zeros(0)
+        orders[field] = np.concatenate(([0], np.rint(values).astype(np.int64)))
+    orders['requests'] = [order[:0]] + np.split(order, starts[1:]) if len(starts) > 0 else [order[:0]]
+
+    cached['problems'][limits] = (requests_sdm, orders)
+    return demand, requests_sdm, orders
+
+
+def route_requests(route, orders):
+    '''
+        Positions (in the demand) of the requests delivered on the route of routing nodes
+    '''
+    return np.concatenate([orders['requests'][node] for node in route])
+
+
+def request_route(route, distance, orders):
+    '''
+        Route of the routing nodes and its leg distances as the route of the requests:
+        the request at position p in the demand is the node p + 1 (as without merging),
+        the legs between the co-located requests are zero
+    '''
+    res_route, res_distance = [], []
+    for node, leg in zip(route, distance):
+        positions = orders['requests'][node]
+        if len(positions) == 0:  # depot
+            res_route.append(node)
+            res_distance.append(leg)
+        else:
+            res_route.extend((positions + 1).tolist())
+            res_distance.extend([leg] + [0] * (len(positions) - 1))
+    return res_route, res_distance
+
+
+def prepare_data(n: net.Net, fill=1.0, upper=False):
+    '''
+        Routing data of the demand of the net
+        The fleet is sized by the bin packing of the routing nodes: the lower bound
+        (the smallest fleet possible) or, if upper, the first fit decreasing packing
+        (enough vehicles for a feasible solution); the unused vehicles are left at the depot
+    '''
+    demand, requests_sdm, orders = prepare_orders(n, fill)
+
+    #   Calculate how many routes are needed to fulfill the demand
+    n.vehicles.min_count, n.vehicles.max_count = fleet.fleet_size(orders['weight'][1:], orders['volume'][1:],
+                                                                  n.vehicles.capacity, n.vehicles.cargo_volume)
+    n.vehicles.count = n.vehicles.max_count if upper else n.vehicles.min_count
+
+    n.vehicles.capacities = []
+    n.vehicles.volumes = []
+    for i in range(n.vehicles.count):
+        n.vehicles.capacities.append(n.vehicles.capacity)
+        n.vehicles.volumes.append(n.vehicles.cargo_volume)
+
+    # for i in range(len(requests_sdm)):
+    #     for j in range(len(requests_sdm)):
+    #         if i == j:
+    #             requests_sdm[i][j] = 0
+    #         else:
+    #             from_node_id = n.demand[i - 1].destination.closest_itsc.nid
+    #             to_node_id = n.demand[j - 1].destination.closest_itsc.nid
+    #             value = n.sdm[from_node_id][to_node_id]*1000
+    #             requests_sdm[i][j] = round(n.sdm[from_node_id][to_node_id]*1000)
+
+    data = {}
+    data['num_vehicles'] = n.vehicles.count
+    data['vehicle_capacities'] = n.vehicles.capacities
+    data['cargo_volume'] = n.vehicles.cargo_volume
+    data['vehicle_load'] = []
+    data['depotID'] = 0
+    for i in range(0, data['num_vehicles']):
+        data['vehicle_load'].append(0)
+
+    print(f"T: {n.thread} Number of vehicles: {data['num_vehicles']} "
+          f"(bounds {n.vehicles.min_count} - {n.vehicles.max_count})")
+
+    return data, orders, requests_sdm, n
+
+
+def solve(n: net.Net, timeout, fill=1.0, best=10, vehicle_cost=0):
+    '''
+        Solves CVRP for the demand of the net: routes of the requests (the request at position p
+        in the demand is the node p + 1, 0 is the depot) and their leg distances
+        The fleet is the lower bound of the bin packing; if no solution is found, the problem
+        is solved once again with the first fit decreasing fleet (see prepare_data)
+        fill - see prepare_orders; if the merged nodes cannot be packed into the fleet,
+        the problem is solved again with a node per request
+        best - number of the best solutions kept and decoded (None - all the solutions found)
+        vehicle_cost - fixed cost of a used vehicle [m] (0 - the distance and span objective only)
+    '''
+    routes, distances, orders, n = solve_orders(n, timeout, fill, best, vehicle_cost)
+    if len(routes) == 0 and n.vehicles.count < n.vehicles.max_count:
+        print(f"Solving again with {n.vehicles.max_count} vehicles (first fit decreasing)")
+        routes, distances, orders, n = solve_orders(n, timeout, fill, best, vehicle_cost, upper=True)
+    if len(routes) == 0 and fill > 0:
+        print("Solving again without merging the co-located requests")
+        routes, distances, orders, n = solve_orders(n, timeout, 0, best, vehicle_cost, upper=True)
+    res_routes, res_distances = [], []
+    for solution_routes, solution_distances in zip(routes, distances):
+        solution = [request_route(route, distance, orders)
+                    for route, distance in zip(solution_routes, solution_distances)]
+        res_routes.append([route for route, _ in solution])
+        res_distances.append([distance for _, distance in solution])
+    return res_routes, res_distances, n
+
+
+def solve_orders(n: net.Net, timeout, fill=1.0, best=10, vehicle_cost=0, upper=False):
+    '''
+        Solves CVRP for the routing nodes of the demand (see prepare_orders):
+        routes of the routing nodes, their leg distances and the orders of the nodes
+        upper - fleet of the upper bound (see prepare_data)
+    '''
+    data, orders, distance_matrix, n = prepare_data(n, fill, upper)
+    manager = pywrapcp.RoutingIndexManager(len(distance_matrix), data['num_vehicles'], data['depotID'])
+
+    routing = pywrapcp.RoutingModel(manager)
+
+    # Register the distance matrix and the demand vectors natively
+    # (evaluated by the solver without calling back into Python)
+    transit_callback_index = routing.RegisterTransitMatrix(distance_matrix.tolist())
+
+    # Define distance of each arc.
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+    # volume constraint
+    volume_callback_index = routing.RegisterUnaryTransitVector(orders['volume'].tolist())
+
+    routing.AddDimension(
+        volume_callback_index,
+        0,  # null capacity slack
+        data['cargo_volume'],  # vehicle maximum capacities
+        True,  # start cumul to zero
+        'Volume')
+
+    # weight constraints
+    demand_callback_index = routing.RegisterUnaryTransitVector(orders['weight'].tolist())
+
+    routing.AddDimensionWithVehicleCapacity(
+        demand_callback_index,
+        0,  # null capacity slack
+        data['vehicle_capacities'],  # vehicle maximum capacities
+        True,  # start cumul to zero
+        'Capacity')
+
+    dimension_name = 'Distance'
+    routing.AddDimension(
+        transit_callback_index,
+        0,  # no slack
+        999999,  # vehicle maximum travel distance
+        True,  # start cumul to zero
+        dimension_name)
+    distance_dimension = routing.GetDimensionOrDie(dimension_name)
+    distance_dimension.SetGlobalSpanCostCoefficient(100)
+    if vehicle_cost > 0:
+        routing.SetFixedCostOfAllVehicles(int(vehicle_cost))
+
+    # Setting first solution heuristic.
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = (routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+    search_parameters.local_search_metaheuristic = (routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
+    search_parameters.solution_limit = 1
+    search_parameters.time_limit.FromSeconds(timeout)
+    search_parameters.use_full_propagation = 1
+
+    # Solve the problem.
+
+    assignment = routing.SolveWithParameters(search_parameters)
+    collector = initialize_collector(data, manager, routing, distance_matrix, best)
+
+    search_parameters.solution_limit = 2 ** 24
+    search_parameters.time_limit.FromSeconds(timeout)
+
+    routing.SolveFromAssignmentWithParameters(assignment, search_parameters)
+
+    routes = []
+    distances = []
+
+    # Print solution on console.
+    if assignment:
+
+        if best is None:
+            print('CVRP feasible solutions: {}'.format(collector.SolutionCount()))
+        else:
+            print('CVRP feasible solutions: {} (the best {} kept)'.format(collector.found, collector.SolutionCount()))
+        for i in range(collector.SolutionCount()):
+            temp_route, temp_distance = list_solution(data,
+                                                      manager,
+                                                      routing,
+                                                      collector.Solution(i),
+                                                      i,
+                                                      distance_matrix)
+
+            routes.append(temp_route)
+            distances.append(temp_distance)
+    else:
+        print("No solutions")
+
+    return routes, distances, orders, n
+
+
+def initialize_collector(data, manager, routing, distance_matrix, best=None):
+    variables = [routing.NextVar(manager.NodeToIndex(node)) for node in range(len(distance_matrix))]
+    variables += [routing.NextVar(routing.Start(v)) for v in range(data['num_vehicles'])]
+    if best is not None:
+        # ranked by the total distance (the solution reported by calculate_total_distances)
+        return BestSolutionCollector(routing, variables, best, routing.GetDimensionOrDie('Distance'))
+
+    collector: SolutionCollector = routing.solver().AllSolutionCollector()
+    collector.AddObjective(routing.CostVar())
+
+    routing.AddSearchMonitor(collector)
+
+    for var in variables:
+        collector.Add(var)
+
+    return collector
+
+
+class BestSolutionCollector:
+    '''
+        Keeps only the k best solutions found by the search,
+        so the memory does not grow with the search length; the solutions are
+        stored as assignments of the next variables and decoded by list_solution
+        dimension - the solutions are ranked by the sum of its cumuls at the route ends
+        (the total distance for the distance dimension), by the objective if None
+        Interface of SolutionCollector: SolutionCount(), Solution(i) (the best first)
+    '''
+
+    def __init__(self, routing, variables, k=1, dimension=None):
+        self.routing = routing
+        self.variables = variables
+        self.k = max(1, k)
+        self.ends = None if dimension is None else [dimension.CumulVar(routing.End(v))
+                                                    for v in range(routing.vehicles())]
+        self.heap = []  # (-cost, counter, assignment), the worst kept solution on the top
+        self.found = 0  # all the solutions found
+        # the assignments are created before the search (not allowed in the callback)
+        self.free = []
+        for _ in range(self.k):
+            assignment = routing.solver().Assignment()
+            assignment.Add(variables)
+            self.free.append(assignment)
+        routing.AddAtSolutionCallback(self.at_solution)
+
+    def at_solution(self):
+        self.found += 1
+        if self.ends is None:
+            cost = self.routing.CostVar().Value()
+        else:
+            cost = sum(end.Value() for end in self.ends)
+        if len(self.heap) == self.k:
+            if cost >= -self.heap[0][0]:
+                return
+            _, _, assignment = heapq.heappop(self.heap)  # reused for the better solution
+        else:
+            assignment = self.free.pop()
+        assignment.Store()
+        heapq.heappush(self.heap, (-cost, self.found, assignment))
+
+    def SolutionCount(self):
+        return len(self.heap)
+
+    def Solution(self, i):
+        return sorted(self.heap, key=lambda item: (-item[0], item[1]))[i][2]
+
+
+def list_solution(data, manager, routing, solution, i, distance_matrix):
+    routes = []
+    distances = []
+
+    total_distance = 0
+    max_route_distance = 0
+
+    for vehicle_id in range(data['num_vehicles']):
+        tempsolution = []
+        index = routing.Start(vehicle_id)
+        if routing.IsEnd(solution.Value(routing.NextVar(index))):
+            continue  # unused vehicle
+
+        route_distance = 0
+        route = []
+        distance = []
+        previous_index = 0
+        while not routing.IsEnd(index):
+            node_index = manager.IndexToNode(index)
+            # print('INDEX {}'.format(node_index))
+            # print('PREV_INDEX {}'.format(previous_index))
+            route.append(node_index)
+            # print(distance_matrix[previous_index][node_index])
+            distance.append(distance_matrix[previous_index][node_index])
+            previous_index = node_index
+            index = solution.Value(routing.NextVar(index))
+
+        route.append(data['depotID'])
+        distance.append(distance_matrix[previous_index][data['depotID']])
+        routes.append(route)
+        distances.append(distance)
+
+    return routes, distances
+
+def calculate_total_distances(routes):
+    total_distances = []
+    for route in routes:
+        single_total_distance = 0
+        for vehicle in route:
+            single_total_distance += sum(vehicle)
+        total_distances.append(single_total_distance)
     return total_distances
\ No newline at end of file
@@ -68,7 +68,7 @@ def generate_network(net, type: str = "bike", draw_network: bool = False, simpli
                 new_node.y = nodes.centroid.y[single_node_index]
 
             new_node.type = 'N'
-            net.nodes.append(new_node)
+            net.add_node(new_node)
 
         links_dict = dict(G_proj.edges)
 
@@ -88,7 +88,7 @@ def generate_network(net, type: str = "bike", draw_network: bool = False, simpli
             new_node.x = nodes_dict[single_node]['x']
             new_node.y = nodes_dict[single_node]['y']
             new_node.type = 'N'
-            net.nodes.append(new_node)
+            net.add_node(new_node)
 
         for single_link in links_dict.keys():
             net.add_link(in_id=single_link[0], out_id=single_link[1],
@@ -96,6 +96,7 @@ def generate_network(net, type: str = "bike", draw_network: bool = False, simpli
 
         for index, single_node in enumerate(net.nodes):
             single_node.nid = index
+        net.reindex()
 
     if draw_network:
         draw(G)
@@ -127,10 +128,14 @@ def draw(graph: networkx.Graph):
     ox.io.save_graphml(G, filepath="results/graph.graphml")
 
 
-def generate_network_and_businesses(n: Net):
+def generate_network_and_businesses(n: Net, sparse: bool = False, cache=None, contract: bool = False,
+                                    processes=None):
     n = generate_network(net=n, simplify=False, simplify_tolerance=10, draw_network=False)
 
-    n.sdm = n.floyd_warshall(n.nodes)  # sdm with intersections only
+    if sparse:  # rows for the demand-relevant sources only (added once the clients are known)
+        n.sdm = n.source_sdm(n.nodes, sources=[])
+    elif not contract:
+        n.sdm = n.floyd_warshall(n.nodes, cache=cache, processes=processes)  # sdm with intersections only
 
 
 
@@ -173,8 +178,12 @@ def generate_network_and_businesses(n: Net):
 
         new_node.y = float(business['X'])
         new_node.x = float(business['Y'])
-        n.nodes.append(new_node)
+        n.add_node(new_node)
 
     n.set_closest_itsc()
+    if sparse:
+        n.sdm.add_sources(n.demand_sources())
+    elif contract:  # degree-2 chains contracted once the clients are snapped
+        n.sdm = n.contracted_sdm([node for node in n.nodes if node.type == 'N'], cache=cache, processes=processes)
 
     return n
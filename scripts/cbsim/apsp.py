@@ -0,0 +1,155 @@
+import os, tempfile, weakref
+import multiprocessing as mp
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+
+def link_arrays(links):
+    '''
+        Out-node ids, in-node ids and weights of the links as numpy arrays
+    '''
+    outs = np.fromiter((lnk.out_node.nid for lnk in links), dtype=np.int64, count=len(links))
+    ins = np.fromiter((lnk.in_node.nid for lnk in links), dtype=np.int64, count=len(links))
+    weights = np.fromiter((lnk.weight for lnk in links), dtype=np.float64, count=len(links))
+    return outs, ins, weights
+
+
+def adjacency_matrix(size, links, dtype=np.float64):
+    '''
+        Weighted adjacency matrix of the net (np.inf if there is no link,
+        0 on the diagonal) for the nodes with ids 0..size-1
+    '''
+    g = np.full((size, size), np.inf, dtype=dtype)
+    np.fill_diagonal(g, 0)
+    if len(links) > 0:
+        outs, ins, weights = link_arrays(links)
+        g[outs, ins] = weights
+    return g
+
+
+def csr_graph(size, links):
+    '''
+        Sparse (CSR) adjacency matrix of the net for the nodes with ids 0..size-1
+        (explicitly stored zeros are zero-weight links)
+    '''
+    outs, ins, weights = link_arrays(links)
+    return csr_matrix((weights, (outs, ins)), shape=(size, size))
+
+
+def multi_source_dijkstra(graph, sources, dtype=None):
+    '''
+        Shortest distances from every source to all nodes of the sparse graph
+        Returns the matrix len(sources) x size (np.inf for unreachable nodes)
+    '''
+    rows = dijkstra(graph, directed=True, indices=np.asarray(sources, dtype=np.int64))
+    return rows.reshape(len(sources), graph.shape[0]).astype(dtype or np.float64, copy=False)
+
+
+# state of the parallel_apsp workers (set by _init_worker)
+_worker = {}
+
+# shared memory file system for the matrices of parallel_apsp (temporary directory if there is none)
+_SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def _init_worker(graph, path):
+    _worker['graph'] = graph
+    _worker['d'] = np.load(path, mmap_mode='r+')
+
+
+def _dijkstra_rows(bounds):
+    start, stop = bounds
+    d = _worker['d']
+    d[start:stop] = multi_source_dijkstra(_worker['graph'], np.arange(start, stop), d.dtype)
+    return stop - start
+
+
+def parallel_apsp(graph, processes=None, dtype=None, chunk=None, out=None):
+    '''
+        All-pairs shortest distances of the sparse graph by the multi-source Dijkstra
+        with the rows partitioned between the worker processes
+        The matrix is filled by the workers in place in a memory-mapped .npy file
+        (no pickling of the rows, no copy of the matrix) and returned as that mapping
+        processes - number of the worker processes (all cores by default)
+        chunk - rows per task (balances the load: size / (4 * processes) by default)
+        out - .npy file to write the matrix into; by default a temporary file in the shared memory
+        (/dev/shm), removed once mapped (the memory is freed with the returned array)
+    '''
+    dtype = np.dtype(dtype or np.float64)
+    size = graph.shape[0]
+    processes = processes or mp.cpu_count()
+    if (processes == 1 or size < 2) and out is None:
+        return multi_source_dijkstra(graph, np.arange(size), dtype)
+    if out is None:
+        fd, path = tempfile.mkstemp(suffix='.npy', dir=_SHM_DIR)
+        os.close(fd)
+    else:
+        path = out
+    d = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(size, size))
+    try:
+        if processes == 1 or size < 2:
+            d[:] = multi_source_dijkstra(graph, np.arange(size), dtype)
+        else:
+            chunk = chunk or max(1, -(-size // (4 * processes)))
+            with mp.Pool(processes, initializer=_init_worker, initargs=(graph, path)) as pool:
+                pool.map(_dijkstra_rows, [(start, min(start + chunk, size)) for start in range(0, size, chunk)])
+        d.flush()
+    finally:
+        if out is None:
+            try:
+                os.remove(path)  # the mapping stays valid (POSIX)
+            except OSError:
+                weakref.finalize(d, os.remove, path)
+    return d
+
+
+def floyd_warshall(g, block=1024, dtype=None):
+    '''
+        Floyd-Warshall algorithm on the adjacency matrix g
+        Every pivot k relaxes the rows with numpy broadcasting
+        (g = min(g, g[:, k] + g[k, :])), processed in blocks of rows
+        to keep the temporaries in cache
+        dtype - np.float32 to halve the memory (float64 by default)
+        Returns the matrix of the shortest distances (g is not changed)
+    '''
+    g = np.array(g, dtype=np.float64 if dtype is None else dtype)
+    size = g.shape[0]
+    block = max(1, min(block, size))
+    tmp = np.empty((block, size), dtype=g.dtype)
+    for k in range(size):
+        row = g[k]
+        for start in range(0, size, block):
+            rows = g[start:start + block]
+            buf = tmp[:rows.shape[0]]
+            np.add(rows[:, k, None], row[None, :], out=buf)
+            np.minimum(rows, buf, out=rows)
+    return g
+
+
+def update_weights(d, graph, changes, block=1024):
+    '''
+        Repairs the shortest distances matrix d (in place) after the link weights changed
+        graph - CSR adjacency with the new weights, changes - [(out, in, old weight, new weight)]
+        Increases: only the rows whose shortest paths may use a changed link
+        are recomputed (multi-source Dijkstra); decreases: d = min(d, d[:, out] + w + d[in, :])
+    '''
+    size = d.shape[0]
+    tol = 16 * np.finfo(d.dtype).eps
+    affected = np.zeros(size, dtype=bool)
+    for u, v, old, new in changes:
+        if new > old:
+            for start in range(0, size, block):
+                rows = d[start:start + block]
+                via = rows[:, u, None] + old + d[None, v, :]
+                affected[start:start + block] |= (np.isfinite(via) & (via <= rows * (1 + tol) + tol)).any(axis=1)
+    sources = np.flatnonzero(affected)
+    if len(sources) > 0:
+        d[sources] = multi_source_dijkstra(graph, sources, d.dtype)[:, :d.shape[1]]
+    for u, v, old, new in changes:
+        if new < old:
+            row = d[v].copy()
+            for start in range(0, size, block):
+                rows = d[start:start + block]
+                np.minimum(rows, rows[:, u, None] + new + row[None, :], out=rows)
+    return d
@@ -0,0 +1,303 @@
+import time, pickle, random, tracemalloc
+import numpy as np
+from ortools.constraint_solver import routing_enums_pb2, pywrapcp
+
+from scripts.cbsim import apsp
+from scripts.cbsim.compact import CompactNet
+from scripts.cbsim.net import Net
+from scripts.cbsim.node import Node
+from scripts.cbsim.request import Request
+from scripts.cbsim.stochastic import Stochastic, AliasTable
+
+
+def grid_net(rows=10, cols=10, step=0.001, weight=0.1):
+    '''
+        Generates a synthetic street grid (rows x cols intersections)
+        with undirected links between the neighbouring intersections
+    '''
+    n = Net()
+    for r in range(rows):
+        for c in range(cols):
+            node = Node(nid=r * cols + c)
+            node.x, node.y = 19.9 + c * step, 50.0 + r * step
+            node.type = 'N'
+            n.add_node(node)
+    for r in range(rows):
+        for c in range(cols):
+            nid = r * cols + c
+            if c + 1 < cols:
+                n.add_link(nid, nid + 1, weight)
+            if r + 1 < rows:
+                n.add_link(nid, nid + cols, weight)
+    return n
+
+
+def edge_list_net(rows=10, cols=10, weight=0.1):
+    '''
+        Street grid built from the edge list only (add_link creates the nodes,
+        so every new id is a miss of the node index)
+    '''
+    n = Net()
+    for r in range(rows):
+        for c in range(cols):
+            nid = r * cols + c
+            if c + 1 < cols:
+                n.add_link(nid, nid + 1, weight)
+            if r + 1 < rows:
+                n.add_link(nid, nid + cols, weight)
+    return n
+
+
+def bench_net_build(sizes=(10, 20, 40, 80), verbose=True):
+    '''
+        Measures the time of the network building (add_link per edge)
+        for square grids of the given sizes: nodes added first (grid_net)
+        and the edge list only (edge_list_net), and of contains_node for absent ids
+        Returns the list of {nodes, links, time, time_per_link, edges_only, edges_only_per_link, miss}
+    '''
+    results = []
+    for size in sizes:
+        start_time = time.perf_counter()
+        n = grid_net(size, size)
+        elapsed = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        edge_list_net(size, size)
+        edges_only = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for nid in range(-1000, 0):
+            n.contains_node(nid)
+        miss = (time.perf_counter() - start_time) / 1000
+        results.append({'nodes': len(n.nodes), 'links': len(n.links), 'time': elapsed,
+                        'time_per_link': elapsed / len(n.links), 'edges_only': edges_only,
+                        'edges_only_per_link': edges_only / len(n.links), 'miss': miss})
+        if verbose:
+            print("{} nodes, {} links: {} sec ({} us per link), edge list only {} sec ({} us per link), "
+                  "absent node lookup {} us".format(
+                      len(n.nodes), len(n.links), round(elapsed, 4), round(1e6 * elapsed / len(n.links), 2),
+                      round(edges_only, 4), round(1e6 * edges_only / len(n.links), 2), round(1e6 * miss, 2)))
+    return results
+
+
+def bench_floyd_warshall(sizes=(10, 20, 30), dtypes=(np.float64, np.float32), verbose=True):
+    '''
+        Measures the time of the vectorized Floyd-Warshall algorithm
+        for square grids of the given sizes
+        Returns the list of {nodes, dtype, time}
+    '''
+    results = []
+    for size in sizes:
+        n = grid_net(size, size)
+        g = apsp.adjacency_matrix(len(n.nodes), n.links)
+        for dtype in dtypes:
+            start_time = time.perf_counter()
+            apsp.floyd_warshall(g, dtype=dtype)
+            elapsed = time.perf_counter() - start_time
+            results.append({'nodes': len(n.nodes), 'dtype': np.dtype(dtype).name, 'time': elapsed})
+            if verbose:
+                print("Floyd-Warshall, {} nodes ({}): {} sec".format(
+                    len(n.nodes), np.dtype(dtype).name, round(elapsed, 4)))
+    return results
+
+
+def bench_compact(sizes=(10, 20, 40), verbose=True):
+    '''
+        Compares the memory and the pickle size of the object graph (Net)
+        and its compact (CSR) representation for square grids of the given sizes
+        Returns the list of {nodes, net_memory, compact_memory, net_pickle, compact_pickle}
+    '''
+    results = []
+    for size in sizes:
+        tracemalloc.start()
+        n = grid_net(size, size)
+        net_memory = tracemalloc.get_traced_memory()[0]
+        cn = CompactNet.from_net(n)
+        compact_memory = tracemalloc.get_traced_memory()[0] - net_memory
+        tracemalloc.stop()
+        try:
+            net_pickle = len(pickle.dumps(n, pickle.HIGHEST_PROTOCOL))
+        except RecursionError:  # deeply linked object graph
+            net_pickle = None
+        compact_pickle = len(pickle.dumps(cn, pickle.HIGHEST_PROTOCOL))
+        results.append({'nodes': len(n.nodes), 'net_memory': net_memory, 'compact_memory': compact_memory,
+                         'net_pickle': net_pickle, 'compact_pickle': compact_pickle})
+        if verbose:
+            print("{} nodes: memory {} / {} bytes, pickle {} / {} bytes (Net / CompactNet)".format(
+                len(n.nodes), net_memory, compact_memory, net_pickle, compact_pickle))
+    return results
+
+
+def bench_update_link_weights(size=30, changed=5, factors=(0.5, 2.0, 10.0), verbose=True):
+    '''
+        Compares the incremental SDM repair (Net.update_link_weights)
+        with the full recomputation for a few changed links of a square grid
+        Returns {incremental, full, equal}
+    '''
+    n = grid_net(size, size)
+    n.sdm = n.floyd_warshall(n.nodes)
+    weights = {}
+    for lnk in random.sample(n.links, changed):
+        weights[(lnk.out_node.nid, lnk.in_node.nid)] = lnk.weight * random.choice(factors)
+    start_time = time.perf_counter()
+    n.update_link_weights(weights)
+    incremental = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    full = n.floyd_warshall(n.nodes)
+    elapsed = time.perf_counter() - start_time
+    equal = bool(np.allclose(n.sdm, full))
+    if verbose:
+        print("SDM update of {} links, {} nodes: {} sec incremental, {} sec full, equal: {}".format(
+            changed, len(n.nodes), round(incremental, 4), round(elapsed, 4), equal))
+    return {'incremental': incremental, 'full': elapsed, 'equal': equal}
+
+
+def bench_hierarchy(sizes=(20, 40, 60), queries=200, verbose=True):
+    '''
+        Compares the preprocessing time of the contraction hierarchy
+        with the latency of its point-to-point queries and of the plain Dijkstra
+        for square grids of the given sizes
+        Returns the list of {nodes, shortcuts, preprocessing, query, dijkstra, equal}
+    '''
+    results = []
+    for size in sizes:
+        n = grid_net(size, size)
+        start_time = time.perf_counter()
+        ch = n.build_hierarchy(n.nodes)
+        preprocessing = time.perf_counter() - start_time
+        pairs = [(random.randrange(len(n.nodes)), random.randrange(len(n.nodes))) for _ in range(queries)]
+        start_time = time.perf_counter()
+        dists = [ch.query(s, t) for s, t in pairs]
+        query = (time.perf_counter() - start_time) / queries
+        graph = apsp.csr_graph(len(n.nodes), n.links)
+        start_time = time.perf_counter()
+        exact = [apsp.multi_source_dijkstra(graph, [s])[0, t] for s, t in pairs]
+        dijkstra = (time.perf_counter() - start_time) / queries
+        equal = bool(np.allclose(dists, exact))
+        results.append({'nodes': len(n.nodes), 'shortcuts': ch.shortcuts, 'preprocessing': preprocessing,
+                        'query': query, 'dijkstra': dijkstra, 'equal': equal})
+        if verbose:
+            print("CH, {} nodes, {} shortcuts: preprocessing {} sec, query {} ms (Dijkstra {} ms), equal: {}".format(
+                len(n.nodes), ch.shortcuts, round(preprocessing, 4), round(1e3 * query, 4),
+                round(1e3 * dijkstra, 4), equal))
+    return results
+
+
+def bench_parallel_apsp(size=60, processes=(1, 2, 4, 8), verbose=True):
+    '''
+        Measures the speedup of the parallel APSP (apsp.parallel_apsp)
+        per number of the worker processes for a square grid
+        Returns the list of {processes, time, speedup, equal}
+    '''
+    n = grid_net(size, size)
+    graph = apsp.csr_graph(len(n.nodes), n.links)
+    results = []
+    base, reference = None, None
+    for count in processes:
+        start_time = time.perf_counter()
+        d = apsp.parallel_apsp(graph, count)
+        elapsed = time.perf_counter() - start_time
+        if base is None:
+            base, reference = elapsed, d
+        results.append({'processes': count, 'time': elapsed, 'speedup': base / elapsed,
+                        'equal': bool(np.allclose(d, reference))})
+        if verbose:
+            print("Parallel APSP, {} nodes, {} processes: {} sec (speedup {})".format(
+                len(n.nodes), count, round(elapsed, 4), round(base / elapsed, 2)))
+    return results
+
+
+def bench_gen_demand(requests=100000, size=40, inlets=4, verbose=True):
+    '''
+        Measures the assignment of origins (proposed Net.gen_demand) for the given number
+        of requests to the clients next to the intersections of a square grid,
+        and the draws from the alias table vs Net.roulette
+        Returns {requests, assigned, gen_demand, roulette, alias}
+    '''
+    n = grid_net(size, size)
+    corners = [0, size - 1, size * (size - 1), size * size - 1][:inlets]
+    n.sdm = n.source_sdm(n.nodes, sources=corners)
+    reqs = []
+    for _ in range(requests):
+        itsc = random.choice(n.nodes)
+        client = Node(nid=-1)
+        client.x, client.y = itsc.x + 0.0001, itsc.y
+        client.type, client.closest_itsc = 'B', itsc
+        reqs.append(Request(dst=client))
+    flows = {nid: requests // len(corners) for nid in corners}
+    start_time = time.perf_counter()
+    assigned = n.gen_demand(flows, {}, requests=reqs, s_weight=Stochastic())
+    gen_demand = time.perf_counter() - start_time
+    probs = {nid: 1 / len(corners) for nid in corners}
+    start_time = time.perf_counter()
+    for _ in range(requests):
+        n.roulette(probs)
+    roulette = time.perf_counter() - start_time
+    table = AliasTable(probs)
+    start_time = time.perf_counter()
+    table.sample(requests)
+    alias = time.perf_counter() - start_time
+    if verbose:
+        print("Origins of {} requests: gen_demand {} sec; {} draws: roulette {} sec, alias table {} sec".format(
+            requests, round(gen_demand, 4), requests, round(roulette, 4), round(alias, 4)))
+    return {'requests': requests, 'assigned': len(assigned), 'gen_demand': gen_demand,
+            'roulette': roulette, 'alias': alias}
+
+
+def _count_solutions(matrix, weights, capacity, vehicles, timeout, native):
+    # number of the solutions found by the guided local search within the timeout
+    manager = pywrapcp.RoutingIndexManager(len(matrix), vehicles, 0)
+    routing = pywrapcp.RoutingModel(manager)
+    if native:
+        transit = routing.RegisterTransitMatrix(matrix.tolist())
+        demand = routing.RegisterUnaryTransitVector(weights.tolist())
+    else:
+        transit = routing.RegisterTransitCallback(
+            lambda i, j: int(matrix[manager.IndexToNode(i)][manager.IndexToNode(j)]))
+        demand = routing.RegisterUnaryTransitCallback(lambda i: int(weights[manager.IndexToNode(i)]))
+    routing.SetArcCostEvaluatorOfAllVehicles(transit)
+    routing.AddDimensionWithVehicleCapacity(demand, 0, [capacity] * vehicles, True, 'Capacity')
+    params = pywrapcp.DefaultRoutingSearchParameters()
+    params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    params.time_limit.FromSeconds(timeout)
+    routing.CloseModelWithParameters(params)
+    collector = routing.solver().AllSolutionCollector()
+    collector.AddObjective(routing.CostVar())
+    routing.AddSearchMonitor(collector)
+    routing.SolveWithParameters(params)
+    return collector.SolutionCount()
+
+
+def bench_transit_callbacks(sizes=(50, 200), timeout=5, verbose=True):
+    '''
+        Compares the solutions per second of CVRP with the Python transit callbacks
+        and with the native matrix / vector registration (as in CVRP.solve)
+        for random requests on a plane
+        Returns the list of {nodes, callbacks, native} [solutions per second]
+    '''
+    results = []
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        xy = rng.uniform(0, 5000, (size, 2))  # m
+        matrix = np.rint(np.hypot(*(xy[:, None, :] - xy[None, :, :]).transpose(2, 0, 1))).astype(np.int64)
+        weights = np.concatenate(([0], rng.integers(100, 25000, size - 1)))
+        vehicles = int(np.ceil(weights.sum() / 150000)) + 1
+        res = {'nodes': size}
+        for native in (False, True):
+            count = _count_solutions(matrix, weights, 150000, vehicles, timeout, native)
+            res['native' if native else 'callbacks'] = count / timeout
+        results.append(res)
+        if verbose:
+            print("CVRP, {} nodes: {} solutions/sec with callbacks, {} with native transits".format(
+                size, round(res['callbacks'], 1), round(res['native'], 1)))
+    return results
+
+
+if __name__ == "__main__":
+    bench_net_build()
+    bench_floyd_warshall()
+    bench_compact()
+    bench_update_link_weights()
+    bench_hierarchy()
+    bench_parallel_apsp()
+    bench_gen_demand()
+    bench_transit_callbacks()
@@ -0,0 +1,167 @@
+import numpy as np
+from scipy.sparse import csr_matrix, csgraph
+from scipy.spatial import cKDTree
+
+from scripts.cbsim import apsp
+from scripts.cbsim.net import Net
+from scripts.cbsim.node import Node
+from scripts.cbsim.region import Region
+from scripts.cbsim.sdm import SourceSDM
+from scripts.cbsim.spatial import to_cartesian
+
+
+class CompactNet:
+    '''
+        Array-backed (CSR) representation of the delivery network
+        Nodes are stored by position (sorted by nid): coordinates, type codes,
+        regions and the closest intersections; links as indptr/indices/weights
+    '''
+
+    def __init__(self):
+        # nodes
+        self.nids = np.array([], dtype=np.int64)
+        self.names = np.array([], dtype=str)
+        self.x = np.array([], dtype=np.float64)
+        self.y = np.array([], dtype=np.float64)
+        self.types = []  # type names, indexed by the type codes
+        self.type_codes = np.array([], dtype=np.uint8)
+        self.inlet = np.array([], dtype=bool)
+        self.outlet = np.array([], dtype=bool)
+        self.region_codes = np.array([], dtype=np.int64)  # -1 if no region
+        self.closest_itsc = np.array([], dtype=np.int64)  # position, -1 if not set
+        # regions: code -> (name, x, y)
+        self.regions = {}
+        # links (CSR)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.array([], dtype=np.int64)
+        self.weights = np.array([], dtype=np.float64)
+
+    def __repr__(self):
+        return "CompactNet({} nodes, {} links, {} bytes)".format(self.size, len(self.indices), self.nbytes)
+
+    @property
+    def size(self):
+        return len(self.nids)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.nids, self.names, self.x, self.y, self.type_codes, self.inlet,
+                                      self.outlet, self.region_codes, self.closest_itsc,
+                                      self.indptr, self.indices, self.weights))
+
+    @property
+    def graph(self):
+        '''
+            The links as the scipy CSR matrix (no copy of the arrays)
+        '''
+        return csr_matrix((self.weights, self.indices, self.indptr), shape=(self.size, self.size))
+
+    @classmethod
+    def from_net(cls, net):
+        '''
+            Builds the compact representation of the Net
+        '''
+        cn = cls()
+        nodes = sorted(net.nodes, key=lambda nd: nd.nid)
+        pos = {id(nd): i for i, nd in enumerate(nodes)}
+        cn.nids = np.array([nd.nid for nd in nodes], dtype=np.int64)
+        cn.names = np.array([nd.name for nd in nodes], dtype=str)
+        cn.x = np.array([nd.x for nd in nodes], dtype=np.float64)
+        cn.y = np.array([nd.y for nd in nodes], dtype=np.float64)
+        codes = {}
+        for nd in nodes:
+            codes.setdefault(nd.type, len(codes))
+        cn.types = list(codes.keys())
+        cn.type_codes = np.array([codes[nd.type] for nd in nodes], dtype=np.uint8)
+        cn.inlet = np.array([nd.inlet for nd in nodes], dtype=bool)
+        cn.outlet = np.array([nd.outlet for nd in nodes], dtype=bool)
+        cn.region_codes = np.array([-1 if nd.region is None else nd.region.code for nd in nodes], dtype=np.int64)
+        cn.closest_itsc = np.array([pos.get(id(nd.closest_itsc), -1) for nd in nodes], dtype=np.int64)
+        cn.regions = {r.code: (r.name, r.x, r.y) for r in net.regions}
+        # links sorted by the out-node position
+        outs = np.array([pos[id(lnk.out_node)] for lnk in net.links], dtype=np.int64)
+        ins = np.array([pos[id(lnk.in_node)] for lnk in net.links], dtype=np.int64)
+        _, _, weights = apsp.link_arrays(net.links)
+        order = np.argsort(outs, kind='stable')
+        cn.indices = ins[order]
+        cn.weights = weights[order]
+        cn.indptr = np.zeros(cn.size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(outs, minlength=cn.size), out=cn.indptr[1:])
+        return cn
+
+    def to_net(self):
+        '''
+            Converts the compact representation back to the Net of objects
+        '''
+        net = Net()
+        for code, (name, x, y) in self.regions.items():
+            region = Region(code=code, name=name)
+            region.x, region.y = x, y
+            net.add_region(region)
+        nodes = []
+        for i in range(self.size):
+            node = Node(nid=int(self.nids[i]), name=str(self.names[i]))
+            node.x, node.y = float(self.x[i]), float(self.y[i])
+            node.type = self.types[self.type_codes[i]]
+            node.inlet, node.outlet = bool(self.inlet[i]), bool(self.outlet[i])
+            if self.region_codes[i] >= 0:
+                node.region = net.get_region(int(self.region_codes[i]))
+                node.region.nodes.append(node)
+            nodes.append(node)
+            net.add_node(node)
+        for i in range(self.size):
+            if self.closest_itsc[i] >= 0:
+                nodes[i].closest_itsc = nodes[self.closest_itsc[i]]
+            for k in range(self.indptr[i], self.indptr[i + 1]):
+                net.add_link(nodes[i].nid, nodes[self.indices[k]].nid, float(self.weights[k]), directed=True)
+        return net
+
+    def floyd_warshall(self, dtype=None):
+        '''
+            Shortest distances between all the nodes
+        '''
+        g = np.full((self.size, self.size), np.inf)
+        np.fill_diagonal(g, 0)
+        outs = np.repeat(np.arange(self.size), np.diff(self.indptr))
+        g[outs, self.indices] = self.weights
+        return apsp.floyd_warshall(g, dtype=dtype)
+
+    def source_sdm(self, sources, dtype=None, max_bytes=None):
+        '''
+            Shortest distances from the given sources only (see SourceSDM)
+        '''
+        return SourceSDM(self.graph, sources, dtype, max_bytes)
+
+    def dijkstra(self, source):
+        '''
+            Shortest path tree from the source position:
+            returns the array of previous positions (-1 for the source and unreachable nodes)
+        '''
+        _, previous = csgraph.dijkstra(self.graph, directed=True, indices=source, return_predecessors=True)
+        return np.where(previous < 0, -1, previous)
+
+    def define_path(self, source, target):
+        '''
+            Positions of the nodes on the shortest path (without the source)
+        '''
+        previous = self.dijkstra(source)
+        u, path = target, []
+        while previous[u] >= 0:
+            path.append(u)
+            u = previous[u]
+        path.reverse()
+        return path
+
+    def set_closest_itsc(self):
+        '''
+            Sets the closest intersection (by the haversine distance)
+            for every node that is not an intersection
+        '''
+        is_itsc = self.type_codes == self.types.index('N') if 'N' in self.types else np.zeros(self.size, bool)
+        itscs = np.flatnonzero(is_itsc)
+        others = np.flatnonzero(~is_itsc)
+        if len(itscs) == 0 or len(others) == 0:
+            return
+        tree = cKDTree(to_cartesian(self.x[itscs], self.y[itscs]))
+        _, idx = tree.query(to_cartesian(self.x[others], self.y[others]))
+        self.closest_itsc[others] = itscs[idx]
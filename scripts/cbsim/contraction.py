@@ -0,0 +1,284 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from scripts.cbsim import apsp
+
+
+class Chain:
+    '''
+        Chain of degree-2 nodes between two kept nodes
+        Attributes: start and end nid, nids of the nodes along the chain (ends included),
+        cumulative distances from start (forward) and from end (backward, None for one-way chains)
+    '''
+
+    def __init__(self, nids, forward, backward=None):
+        self.nids = nids
+        self.forward = forward
+        self.backward = backward
+
+    def __repr__(self):
+        return "Chain {} -> {}: {} nodes, {} km".format(self.start, self.end, len(self.nids) - 2,
+                                                        round(self.forward[-1], 3))
+
+    @property
+    def start(self):
+        return self.nids[0]
+
+    @property
+    def end(self):
+        return self.nids[-1]
+
+    def exits(self, p):
+        '''
+            Kept nodes reachable from the p-th node of the chain: [(nid, distance)]
+        '''
+        res = [(self.end, self.forward[-1] - self.forward[p])]
+        if self.backward is not None:
+            res.append((self.start, self.backward[0] - self.backward[p]))
+        return res
+
+    def entries(self, p):
+        '''
+            Kept nodes the p-th node of the chain is reachable from: [(nid, distance)]
+        '''
+        res = [(self.start, self.forward[p])]
+        if self.backward is not None:
+            res.append((self.end, self.backward[p]))
+        return res
+
+    def along(self, p, q):
+        '''
+            Distance from the p-th to the q-th node of the chain without leaving it
+        '''
+        if q >= p:
+            return self.forward[q] - self.forward[p]
+        if self.backward is not None:
+            return self.backward[q] - self.backward[p]
+        return np.inf
+
+
+class Contraction:
+    '''
+        Topology-preserving contraction of the degree-2 chains of the graph
+        The kept nodes (chain ends, the given keep set) get contracted ids 0..M-1,
+        every chain becomes a single link weighted by the chain length
+    '''
+
+    def __init__(self, nodes, keep=()):
+        self.nodes = list(nodes)
+        self.size = len(nodes)
+        by_nid = {nd.nid: nd for nd in nodes}
+        keep = set(keep)
+        self.keep = sorted(keep)
+        through = {nd.nid for nd in nodes if nd.nid not in keep and self._is_through(nd)}
+        kept = sorted(nid for nid in by_nid if nid not in through)
+        self.chains = []
+        self.chain_of = {}  # removed nid: (chain index, position in the chain)
+        links = {}  # (out nid, in nid): (weight, chain index or None)
+        queue = list(kept)
+        while True:
+            for nid in queue:
+                self._walk(by_nid[nid], through, links)
+            # cycles made of degree-2 nodes only: keep one node per cycle
+            rest = sorted(through - self.chain_of.keys())
+            if len(rest) == 0:
+                break
+            through.discard(rest[0])
+            kept.append(rest[0])
+            queue = [rest[0]]
+        self.kept = np.array(sorted(kept), dtype=np.int64)  # contracted id -> original nid
+        self.pos = np.full(self.size, -1, dtype=np.int64)  # original nid -> contracted id
+        self.pos[self.kept] = np.arange(len(self.kept))
+        # contracted links: (out id, in id) -> weight, chain index (for drawing)
+        self.links = {(self.pos[u], self.pos[v]): w for (u, v), (w, _) in links.items()}
+        self.link_chain = {(self.pos[u], self.pos[v]): k for (u, v), (_, k) in links.items() if k is not None}
+
+    def __repr__(self):
+        return "Contraction: {} -> {} nodes, {} chains".format(self.size, len(self.kept), len(self.chains))
+
+    @staticmethod
+    def _is_through(node):
+        outs = {lnk.in_node.nid for lnk in node.out_links}
+        ins = {lnk.out_node.nid for lnk in node.in_links}
+        if node.nid in outs or len(outs) != len(node.out_links) or len(ins) != len(node.in_links):
+            return False  # loops or parallel links
+        if len(outs) == 2 and outs == ins:
+            return True  # two-way street
+        return len(outs) == 1 and len(ins) == 1 and outs != ins  # one-way street
+
+    def _walk(self, source, through, links):
+        for lnk in source.out_links:
+            nid = lnk.in_node.nid
+            if nid in self.chain_of:
+                continue  # the chain was walked from its other end
+            nodes, forward = [source], [0, lnk.weight]
+            prev, cur = source, lnk.in_node
+            while cur.nid in through and cur.nid not in self.chain_of and cur is not source:
+                self.chain_of[cur.nid] = (len(self.chains), len(nodes))
+                nodes.append(cur)
+                nxt = [ln for ln in cur.out_links if ln.in_node is not prev or len(cur.out_links) == 1][0]
+                prev, cur = cur, nxt.in_node
+                forward.append(forward[-1] + nxt.weight)
+            nodes.append(cur)
+            if len(nodes) == 2:  # no degree-2 nodes in between
+                self._add_link(links, source.nid, cur.nid, forward[-1], None)
+                continue
+            backward = None
+            if len(nodes[1].out_links) == 2:  # two-way chain
+                backward = [0.0 for _ in nodes]
+                for p in range(len(nodes) - 2, -1, -1):
+                    lnk_back = [ln for ln in nodes[p + 1].out_links if ln.in_node is nodes[p]][0]
+                    backward[p] = backward[p + 1] + lnk_back.weight
+            self.chains.append(Chain([nd.nid for nd in nodes], np.array(forward),
+                                     None if backward is None else np.array(backward)))
+            if cur is not source:
+                k = len(self.chains) - 1
+                self._add_link(links, source.nid, cur.nid, forward[-1], k)
+                if backward is not None:
+                    self._add_link(links, cur.nid, source.nid, backward[0], k)
+
+    @staticmethod
+    def _add_link(links, u, v, w, k):
+        # parallel chains: the shortest one is kept
+        if (u, v) not in links or w < links[(u, v)][0]:
+            links[(u, v)] = (w, k)
+
+    def graph(self):
+        '''
+            CSR adjacency matrix of the contracted graph
+        '''
+        m = len(self.kept)
+        if len(self.links) == 0:
+            return csr_matrix((m, m))
+        keys = np.array(list(self.links.keys()), dtype=np.int64)
+        return csr_matrix((np.array(list(self.links.values())), (keys[:, 0], keys[:, 1])), shape=(m, m))
+
+    def floyd_warshall(self, dtype=None):
+        '''
+            Shortest distances between the kept nodes (by contracted ids)
+        '''
+        g = np.full((len(self.kept), len(self.kept)), np.inf)
+        np.fill_diagonal(g, 0)
+        for (u, v), w in self.links.items():
+            g[u, v] = w
+        return apsp.floyd_warshall(g, dtype=dtype)
+
+    def expand(self, u, v):
+        '''
+            Original nids along the contracted link u -> v (for drawing)
+        '''
+        k = self.link_chain.get((u, v))
+        if k is None:
+            return [int(self.kept[u]), int(self.kept[v])]
+        nids = self.chains[k].nids
+        return nids if nids[0] == self.kept[u] else nids[::-1]
+
+    def exits(self, nid):
+        if self.pos[nid] >= 0:
+            return [(nid, 0)]
+        k, p = self.chain_of[nid]
+        return self.chains[k].exits(p)
+
+    def entries(self, nid):
+        if self.pos[nid] >= 0:
+            return [(nid, 0)]
+        k, p = self.chain_of[nid]
+        return self.chains[k].entries(p)
+
+
+class ContractedSDM:
+    '''
+        SDM of the contracted graph indexed by the original nids (sdm[i][j], sdm[i, j])
+        Distances to and from the contracted nodes go through the ends of their chains
+    '''
+
+    def __init__(self, d, contraction):
+        self.d = d  # distances between the kept nodes
+        self.contraction = contraction
+        self._ends = None  # chain ends of every node as arrays (see _end_arrays)
+
+    def __repr__(self):
+        return "ContractedSDM({} x {} of {} nodes)".format(*self.d.shape, self.contraction.size)
+
+    @property
+    def shape(self):
+        return self.contraction.size, self.contraction.size
+
+    def __len__(self):
+        return self.contraction.size
+
+    def distance(self, i, j):
+        c = self.contraction
+        pi, pj = c.pos[i], c.pos[j]
+        if pi >= 0 and pj >= 0:
+            return self.d[pi, pj]
+        if i == j:
+            return 0.0
+        res = np.inf
+        if pi < 0 and pj < 0 and c.chain_of[i][0] == c.chain_of[j][0]:
+            res = c.chains[c.chain_of[i][0]].along(c.chain_of[i][1], c.chain_of[j][1])
+        for u, du in c.exits(i):
+            for v, dv in c.entries(j):
+                res = min(res, du + self.d[c.pos[u], c.pos[v]] + dv)
+        return res
+
+    def _end_arrays(self):
+        # contracted ids and distances of the exits and the entries (two slots, np.inf if unused)
+        # of every node, chain index (-1 for the kept nodes) and position in the chain
+        if self._ends is None:
+            c = self.contraction
+            pos = np.zeros((2, 2, c.size), dtype=np.int64)
+            off = np.full((2, 2, c.size), np.inf)
+            kept = c.pos >= 0
+            pos[:, 0, kept] = c.pos[kept]
+            off[:, 0, kept] = 0
+            chain = np.full(c.size, -1, dtype=np.int64)
+            place = np.zeros(c.size, dtype=np.int64)
+            for nid, (k, p) in c.chain_of.items():
+                chain[nid], place[nid] = k, p
+                for side, ends in enumerate((c.exits(nid), c.entries(nid))):
+                    for slot, (u, du) in enumerate(ends):
+                        pos[side, slot, nid], off[side, slot, nid] = c.pos[u], du
+            self._ends = pos, off, chain, place
+        return self._ends
+
+    def block(self, sources, targets):
+        '''
+            Distances len(sources) x len(targets) (original nids):
+            the blocks of the kept nodes matrix between the chain ends plus the distances to the ends
+        '''
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        pos, off, chain, place = self._end_arrays()
+        res = np.full((len(sources), len(targets)), np.inf)
+        for a in range(2):
+            for b in range(2):
+                np.minimum(res, off[0, a, sources][:, None] + self.d[np.ix_(pos[0, a, sources], pos[1, b, targets])]
+                           + off[1, b, targets][None, :], out=res)
+        # both nodes in the same chain: also along the chain
+        same = (chain[sources][:, None] == chain[targets][None, :]) & (chain[sources][:, None] >= 0)
+        for i, j in zip(*np.nonzero(same)):
+            k = self.contraction.chains[chain[sources[i]]]
+            res[i, j] = min(res[i, j], k.along(place[sources[i]], place[targets[j]]))
+        return res
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.distance(int(key[0]), int(key[1]))
+        return ContractedRow(self, int(key))
+
+
+class ContractedRow:
+    '''
+        Row of ContractedSDM (for the sdm[i][j] access)
+    '''
+
+    def __init__(self, sdm, i):
+        self.sdm = sdm
+        self.i = i
+
+    def __len__(self):
+        return len(self.sdm)
+
+    def __getitem__(self, j):
+        return self.sdm.distance(self.i, int(j))
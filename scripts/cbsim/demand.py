@@ -0,0 +1,138 @@
+import numpy as np
+
+from scripts.cbsim.request import Request
+
+# fields of the demand records: destination and its closest intersection (nids, -1 if none),
+# weight [g] and dimensions [mm] of the parcel
+DEMAND_DTYPE = np.dtype([('destination', np.int64), ('closest_itsc', np.int64), ('weight', np.float64),
+                         ('length', np.float64), ('width', np.float64), ('height', np.float64),
+                         ('volume', np.float64)])
+
+
+class DemandBatch:
+    '''
+        Demand as the structured array of records (see DEMAND_DTYPE)
+        to be consumed by the vectorized operations (batch.data['weight'].sum())
+        Iteration, indexing and len() give Request objects, materialised on the first use,
+        so the Request-based code works with the batch as with the list
+    '''
+
+    def __init__(self, data, origin=None, destinations=None):
+        self.data = data
+        self.origin = origin  # common origin node (the sender)
+        self.destinations = destinations  # destination nodes of the records
+        self._requests = None
+
+    def __repr__(self):
+        return "DemandBatch({} requests)".format(len(self.data))
+
+    @classmethod
+    def from_requests(cls, requests):
+        '''
+            Batch of the existing Request objects (they are kept for iteration)
+        '''
+        requests = list(requests)
+        count = len(requests)
+        data = np.zeros(count, dtype=DEMAND_DTYPE)
+        data['destination'] = np.fromiter((r.destination.nid for r in requests), dtype=np.int64, count=count)
+        data['closest_itsc'] = np.fromiter((-1 if r.destination.closest_itsc is None else r.destination.closest_itsc.nid
+                                            for r in requests), dtype=np.int64, count=count)
+        for field in ('weight', 'length', 'width', 'height', 'volume'):
+            data[field] = np.fromiter((getattr(r, field) for r in requests), dtype=np.float64, count=count)
+        batch = cls(data, destinations=[r.destination for r in requests])
+        batch._requests = requests
+        return batch
+
+    @classmethod
+    def concat(cls, batches):
+        '''
+            Joins the batches (or lists of Request objects) into one batch
+        '''
+        parts = [b if isinstance(b, DemandBatch) else cls.from_requests(b) for b in batches]
+        parts = [b for b in parts if len(b) > 0]
+        if len(parts) == 0:
+            return cls.from_requests([])
+        if len(parts) == 1:
+            return parts[0]
+        batch = cls(np.concatenate([b.data for b in parts]),
+                    destinations=[nd for b in parts for nd in b.destinations])
+        batch._requests = [r for b in parts for r in b.requests()]
+        return batch
+
+    def requests(self):
+        '''
+            Request objects of the records (created once)
+        '''
+        if self._requests is None:
+            fields = zip(*(self.data[field].tolist() for field in ('weight', 'length', 'width', 'height')))
+            self._requests = [Request(weight=weight, length=length, width=width, height=height,
+                                      orgn=self.origin, dst=dst)
+                              for (weight, length, width, height), dst in zip(fields, self.destinations)]
+        return self._requests
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.requests())
+
+    def __getitem__(self, i):
+        return self.requests()[i]
+
+
+class Scenarios:
+    '''
+        Requests of K demand scenarios generated at once (see Net.gen_scenarios)
+        Every request is a position in the flat arrays: scenario index,
+        destination (index in nodes), weight and dimensions
+    '''
+
+    def __init__(self, sender, nodes, k, scenario, destination, weight, length, width, height):
+        self.sender = sender
+        self.nodes = nodes  # candidate destinations
+        self.k = k
+        self.scenario = scenario
+        self.destination = destination
+        self.weight = weight
+        self.length = length
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return "Scenarios({} scenarios, {} requests)".format(self.k, len(self.scenario))
+
+    def __len__(self):
+        return self.k
+
+    def counts(self):
+        '''
+            Number of the requests in every scenario
+        '''
+        return np.bincount(self.scenario, minlength=self.k)
+
+    def select(self, k):
+        '''
+            Positions of the requests of the k-th scenario
+        '''
+        return np.flatnonzero(self.scenario == k)
+
+    def batch(self, k=0):
+        '''
+            DemandBatch of the k-th scenario
+        '''
+        sel = self.select(k)
+        data = np.zeros(len(sel), dtype=DEMAND_DTYPE)
+        destinations = [self.nodes[i] for i in self.destination[sel]]
+        data['destination'] = np.fromiter((nd.nid for nd in destinations), dtype=np.int64, count=len(sel))
+        data['closest_itsc'] = np.fromiter((-1 if nd.closest_itsc is None else nd.closest_itsc.nid
+                                            for nd in destinations), dtype=np.int64, count=len(sel))
+        for field in ('weight', 'length', 'width', 'height'):
+            data[field] = getattr(self, field)[sel]
+        data['volume'] = data['length'] * data['width'] * data['height']
+        return DemandBatch(data, origin=self.sender, destinations=destinations)
+
+    def requests(self, k=0):
+        '''
+            Request objects of the k-th scenario (for CVRP and simulation)
+        '''
+        return self.batch(k).requests()
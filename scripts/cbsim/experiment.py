@@ -172,3 +172,64 @@ def separate_var_t_test(xs, ys, alpha=0.05):
         'talpha': talpha,
         'result': t < talpha
     }
+
+class SequentialStopping:
+    '''
+        Sequential stopping rule for the replications of an experiment
+        Running mean and variance of every metric are updated online (Welford),
+        the experiment is done when the relative half-width of the confidence interval
+        (t-distribution) of every metric is below error (and at least min_size results came)
+    '''
+
+    def __init__(self, metrics=('saved_distance', 'van_emissions'), error=0.05, alpha=0.05, min_size=5,
+                 max_size=None):
+        self.metrics = list(metrics)
+        self.error = error
+        self.alpha = alpha
+        self.min_size = max(2, min_size)
+        self.max_size = max_size
+        self.size = 0
+        self.means = {m: 0.0 for m in self.metrics}
+        self.m2 = {m: 0.0 for m in self.metrics}  # sums of the squared deviations
+
+    def __repr__(self):
+        return 'SequentialStopping({} results, {})'.format(
+            self.size, ', '.join('{}: {}'.format(m, round(self.relative_error(m), 4)) for m in self.metrics))
+
+    def add(self, **values):
+        '''
+            Adds the result of one replication: add(saved_distance=..., van_emissions=...)
+            Returns True if the experiment is done
+        '''
+        self.size += 1
+        for m in self.metrics:
+            delta = values[m] - self.means[m]
+            self.means[m] += delta / self.size
+            self.m2[m] += delta * (values[m] - self.means[m])
+        return self.done
+
+    def var(self, metric):
+        return self.m2[metric] / (self.size - 1) if self.size > 1 else np.inf
+
+    def half_width(self, metric):
+        if self.size < 2:
+            return np.inf
+        return stats.t.ppf(1 - self.alpha / 2, self.size - 1) * np.sqrt(self.var(metric) / self.size)
+
+    def relative_error(self, metric):
+        mean = abs(self.means[metric])
+        return self.half_width(metric) / mean if mean > 0 else np.inf
+
+    @property
+    def done(self):
+        if self.max_size is not None and self.size >= self.max_size:
+            return True
+        return self.size >= self.min_size and all(self.relative_error(m) <= self.error for m in self.metrics)
+
+    def stats(self):
+        res = {m: {'mean': round(self.means[m], 3), 'std': round(np.sqrt(self.var(m)), 3),
+                   'half_width': round(self.half_width(m), 3), 'relative_error': round(self.relative_error(m), 4)}
+               for m in self.metrics}
+        res['size'] = self.size
+        res['done'] = self.done
+        return res
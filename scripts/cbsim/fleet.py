@@ -0,0 +1,78 @@
+from math import ceil
+import numpy as np
+
+
+def _martello_toth(sizes, capacity):
+    # L2 bound of the one-dimensional bin packing (Martello, Toth) over all the thresholds
+    sizes = np.sort(np.asarray(sizes, dtype=np.float64))
+    if len(sizes) == 0:
+        return 0
+    big = int(np.count_nonzero(sizes > capacity / 2))  # no two of them fit in a bin
+    alphas = np.unique(sizes[sizes <= capacity / 2])
+    if len(alphas) == 0:
+        return big
+    prefix = np.concatenate(([0.0], np.cumsum(sizes)))
+    # J1: size > capacity - alpha, J2: capacity / 2 < size <= capacity - alpha, J3: alpha <= size <= capacity / 2
+    half = np.searchsorted(sizes, capacity / 2, side='right')
+    j1 = np.searchsorted(sizes, capacity - alphas, side='right')
+    j3 = np.searchsorted(sizes, alphas, side='left')
+    count2 = j1 - half
+    free2 = count2 * capacity - (prefix[j1] - prefix[half])  # room left in the J2 bins
+    size3 = prefix[half] - prefix[j3]
+    extra = np.ceil(np.maximum(0, size3 - free2) / capacity)
+    return int(max(big, (len(sizes) - j1 + count2 + extra).max()))
+
+
+def lower_bound(weights, volumes, capacity, cargo_volume):
+    '''
+        Lower bound of the number of vehicles to carry the items (weights [g], volumes [mm3])
+        Maximum of the bin-packing bounds of both dimensions and of the bound by the items
+        heavier or larger than half of the vehicle (at most two of them fit in a vehicle)
+    '''
+    weights = np.asarray(weights, dtype=np.float64)
+    volumes = np.asarray(volumes, dtype=np.float64)
+    if len(weights) == 0:
+        return 0
+    # a vehicle carries at most one item heavier than half of the capacity and one larger than half of the volume
+    incompatible = np.count_nonzero((weights > capacity / 2) | (volumes > cargo_volume / 2))
+    return max(ceil(weights.sum() / capacity), ceil(volumes.sum() / cargo_volume),
+               _martello_toth(weights, capacity), _martello_toth(volumes, cargo_volume),
+               ceil(incompatible / 2))
+
+
+def first_fit_decreasing(weights, volumes, capacity, cargo_volume):
+    '''
+        Packing of the items into the vehicles by the first fit decreasing heuristic
+        (items sorted by the larger of their relative weight and volume)
+        Returns the vehicle of every item; an item not fitting any vehicle gets its own one
+    '''
+    weights = np.asarray(weights, dtype=np.float64)
+    volumes = np.asarray(volumes, dtype=np.float64)
+    order = np.argsort(-np.maximum(weights / capacity, volumes / cargo_volume), kind='stable')
+    loads = np.zeros((0, 2))  # weight, volume of every vehicle
+    res = np.zeros(len(weights), dtype=np.int64)
+    for i in order:
+        fits = np.flatnonzero((loads[:, 0] + weights[i] <= capacity) & (loads[:, 1] + volumes[i] <= cargo_volume))
+        if len(fits) > 0:
+            res[i] = fits[0]
+            loads[fits[0]] += (weights[i], volumes[i])
+        else:
+            res[i] = len(loads)
+            loads = np.vstack((loads, (weights[i], volumes[i])))
+    return res
+
+
+def upper_bound(weights, volumes, capacity, cargo_volume):
+    '''
+        Number of vehicles of the first fit decreasing packing (enough for a feasible CVRP solution)
+    '''
+    packing = first_fit_decreasing(weights, volumes, capacity, cargo_volume)
+    return int(packing.max()) + 1 if len(packing) > 0 else 0
+
+
+def fleet_size(weights, volumes, capacity, cargo_volume):
+    '''
+        (lower, upper) bounds of the number of vehicles to carry the items
+    '''
+    return (lower_bound(weights, volumes, capacity, cargo_volume),
+            upper_bound(weights, volumes, capacity, cargo_volume))
@@ -0,0 +1,191 @@
+import heapq
+import numpy as np
+
+
+class ContractionHierarchy:
+    '''
+        Contraction hierarchy of the net for fast point-to-point shortest distances
+        Preprocessing: nodes are contracted in the edge-difference order,
+        shortcuts keep the distances between the remaining nodes
+        Query: bidirectional Dijkstra on the upward edges only
+    '''
+
+    def __init__(self, nodes, links, max_settled=100):
+        self.max_settled = max_settled  # limit of the witness search
+        self.rank = {}  # nid: contraction order
+        self.up = {nd.nid: {} for nd in nodes}  # forward search edges: {nid: {higher nid: weight}}
+        self.down = {nd.nid: {} for nd in nodes}  # backward search edges: {nid: {higher nid: weight}}
+        self.middle = {}  # shortcut (u, x): contracted node v
+        self.shortcuts = 0
+        # remaining graph
+        out = {nd.nid: {} for nd in nodes}
+        inn = {nd.nid: {} for nd in nodes}
+        for lnk in links:
+            u, x = lnk.out_node.nid, lnk.in_node.nid
+            if u != x and (x not in out[u] or lnk.weight < out[u][x]):
+                out[u][x] = lnk.weight
+                inn[x][u] = lnk.weight
+        self._contract_all(out, inn)
+
+    def __repr__(self):
+        return "ContractionHierarchy({} nodes, {} shortcuts)".format(len(self.rank), self.shortcuts)
+
+    def _witness(self, source, excluded, limit, out):
+        # distances from source avoiding the excluded node (bounded search)
+        dist = {source: 0}
+        q = [(0, source)]
+        settled = 0
+        while len(q) > 0 and settled < self.max_settled:
+            d, u = heapq.heappop(q)
+            if d > dist[u]:
+                continue
+            if d > limit:
+                break
+            settled += 1
+            for x, w in out[u].items():
+                if x == excluded:
+                    continue
+                alt = d + w
+                if alt < dist.get(x, np.inf):
+                    dist[x] = alt
+                    heapq.heappush(q, (alt, x))
+        return dist
+
+    def _shortcuts(self, v, out, inn):
+        # shortcuts needed to contract v: [(u, x, weight)]
+        res = []
+        if len(out[v]) == 0:
+            return res
+        limit = max(out[v].values())
+        for u, w1 in inn[v].items():
+            dist = self._witness(u, v, w1 + limit, out)
+            for x, w2 in out[v].items():
+                if x != u and dist.get(x, np.inf) > w1 + w2:
+                    res.append((u, x, w1 + w2))
+        return res
+
+    def _priority(self, v, out, inn, deleted):
+        return len(self._shortcuts(v, out, inn)) - len(out[v]) - len(inn[v]) + deleted[v]
+
+    def _contract_all(self, out, inn):
+        deleted = {v: 0 for v in out}  # contracted neighbours
+        q = [(self._priority(v, out, inn, deleted), v) for v in out]
+        heapq.heapify(q)
+        while len(q) > 0:
+            _, v = heapq.heappop(q)
+            # lazy update of the priority
+            p = self._priority(v, out, inn, deleted)
+            if len(q) > 0 and p > q[0][0]:
+                heapq.heappush(q, (p, v))
+                continue
+            for u, x, w in self._shortcuts(v, out, inn):
+                if w < out[u].get(x, np.inf):
+                    out[u][x] = w
+                    inn[x][u] = w
+                    self.middle[(u, x)] = v
+                    self.shortcuts += 1
+            self.rank[v] = len(self.rank)
+            # the remaining neighbours are higher in the hierarchy
+            self.up[v] = dict(out[v])
+            self.down[v] = dict(inn[v])
+            for x in out[v]:
+                del inn[x][v]
+                deleted[x] += 1
+            for u in inn[v]:
+                del out[u][v]
+                deleted[u] += 1
+            out[v], inn[v] = {}, {}
+
+    def _search(self, source, edges):
+        # full upward search space: {nid: distance}, {nid: previous nid}
+        dist, previous = {source: 0}, {source: None}
+        q = [(0, source)]
+        while len(q) > 0:
+            d, u = heapq.heappop(q)
+            if d > dist[u]:
+                continue
+            for x, w in edges[u].items():
+                alt = d + w
+                if alt < dist.get(x, np.inf):
+                    dist[x] = alt
+                    previous[x] = u
+                    heapq.heappush(q, (alt, x))
+        return dist, previous
+
+    def query(self, source, target, path=False):
+        '''
+            Shortest distance from source to target (nids) by the bidirectional search
+            If path, returns (distance, [nids of the path]) (empty path if unreachable)
+        '''
+        dists = ({source: 0}, {target: 0})
+        previous = ({source: None}, {target: None})
+        queues = ([(0, source)], [(0, target)])
+        edges = (self.up, self.down)
+        best, meet = (0, source) if source == target else (np.inf, None)
+        while len(queues[0]) > 0 or len(queues[1]) > 0:
+            for side in (0, 1):
+                q, dist, prev = queues[side], dists[side], previous[side]
+                if len(q) == 0 or q[0][0] >= best:
+                    q.clear()  # nothing shorter can be found on this side
+                    continue
+                d, u = heapq.heappop(q)
+                if d > dist[u]:
+                    continue
+                other = dists[1 - side].get(u)
+                if other is not None and d + other < best:
+                    best, meet = d + other, u
+                for x, w in edges[side][u].items():
+                    alt = d + w
+                    if alt < dist.get(x, np.inf):
+                        dist[x] = alt
+                        prev[x] = u
+                        heapq.heappush(q, (alt, x))
+        if not path:
+            return best
+        if meet is None:
+            return best, []
+        return best, self._path(previous[0], previous[1], meet)
+
+    def _path(self, forward, backward, meet):
+        # upward edges from source to meet, downward edges from meet to target
+        ups = []
+        u = meet
+        while forward[u] is not None:
+            ups.append((forward[u], u))
+            u = forward[u]
+        ups.reverse()
+        u = meet
+        while backward[u] is not None:
+            ups.append((u, backward[u]))
+            u = backward[u]
+        nids = [ups[0][0]] if len(ups) > 0 else [meet]
+        for a, b in ups:
+            nids.extend(self._unpack(a, b))
+        return nids
+
+    def _unpack(self, a, b):
+        # original nids of the edge a -> b (without a)
+        v = self.middle.get((a, b))
+        if v is None:
+            return [b]
+        return self._unpack(a, v) + self._unpack(v, b)
+
+    def many_to_many(self, sources, targets):
+        '''
+            Matrix of the shortest distances len(sources) x len(targets)
+            (one upward search per node, meeting in the buckets)
+        '''
+        res = np.full((len(sources), len(targets)), np.inf)
+        buckets = {}  # nid: [(target index, distance)]
+        for j, t in enumerate(targets):
+            dist, _ = self._search(t, self.down)
+            for v, d in dist.items():
+                buckets.setdefault(v, []).append((j, d))
+        for i, s in enumerate(sources):
+            dist, _ = self._search(s, self.up)
+            row = res[i]
+            for v, d in dist.items():
+                for j, dt in buckets.get(v, ()):
+                    if d + dt < row[j]:
+                        row[j] = d + dt
+        return res
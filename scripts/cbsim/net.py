@@ -1,9 +1,17 @@
-import math, random
 import time
+import heapq
+from collections import OrderedDict
+from functools import lru_cache
 import numpy as np
 import shapely
 
-from scripts.cbsim.stochastic import Stochastic
+from scripts.cbsim import apsp, spatial
+from scripts.cbsim.contraction import Contraction, ContractedSDM
+from scripts.cbsim.demand import DemandBatch, Scenarios
+from scripts.cbsim.hierarchy import ContractionHierarchy
+from scripts.cbsim.sdm import SourceSDM
+from scripts.cbsim.spatial import SpatialIndex
+from scripts.cbsim.stochastic import Stochastic, AliasTable
 from scripts.cbsim.node import Node
 from scripts.cbsim.link import Link
 from scripts.cbsim.region import Region
@@ -11,6 +19,12 @@ from scripts.cbsim.request import Request
 from scripts.cbsim.route import Route
 
 
+@lru_cache(maxsize=64)
+def _alias_table(items):
+    # alias table of the probabilities given as the tuple of (key, prob) (see Net.roulette)
+    return AliasTable(dict(items))
+
+
 class Net:
     '''
         Delivery network as the graph model
@@ -21,15 +35,33 @@ class Net:
         self.nodes = []
         self.links = []
         self.regions = []
-        # transport demand
+        # transport demand (list of requests or DemandBatch)
         self.demand = []
+        # distances and orders of the current demand prepared for CVRP (see CVRP.prepare_orders)
+        self.prepared = None
         # shortest distances od_matrix
         self.sdm = np.array([[]])
-        # matrix representation
+        # contraction hierarchy for the point-to-point distances (see build_hierarchy)
+        self.ch = None
+        # matrix representation (dense adjacency matrix, None in the sparse mode)
         self.mtx = np.array([[]])
+        # sparse (CSR) adjacency matrix, set instead of mtx in the sparse mode (see load_from_file)
+        self.graph = None
         self.bbox = None
         self.polygon = None
         self.vehicles = None
+        # rounding of the GPS distances [km], None for the full precision
+        self.gps_decimals = 3
+        # hash indexes: nid -> Node, (out nid, in nid) -> Link, code -> Region
+        self._node_idx = {}
+        self._link_idx = {}
+        self._region_idx = {}
+        self._idx_sizes = (0, 0, 0)
+        # LRU cache of the shortest path trees: source nid -> previous nodes
+        self.paths_cache_size = 256
+        self._paths_cache = OrderedDict()
+        self.paths_cache_hits = 0
+        self.paths_cache_misses = 0
 
     def __repr__(self):
         res = "The network configuration:\n"
@@ -39,103 +71,140 @@ class Net:
                                               round(lnk.weight, 3))
         return res
 
+    def reindex(self):
+        '''
+            Rebuilds the hash indexes of nodes, links and regions
+            (to be called after the node ids were changed in place
+            or the nodes, links or regions were replaced in their lists)
+        '''
+        self._node_idx, self._link_idx, self._region_idx = {}, {}, {}
+        for n in self.nodes:
+            self._node_idx.setdefault(n.nid, n)
+        for lnk in self.links:
+            self._link_idx.setdefault((lnk.out_node.nid, lnk.in_node.nid), lnk)
+        for region in self.regions:
+            self._region_idx.setdefault(region.code, region)
+        self._idx_sizes = (len(self.nodes), len(self.links), len(self.regions))
+        self._paths_cache.clear()
+
+    def _check_index(self):
+        # nodes, links or regions were added to the lists directly
+        if self._idx_sizes != (len(self.nodes), len(self.links), len(self.regions)):
+            self.reindex()
+
+    def _grow_index(self, nodes=0, links=0, regions=0):
+        sn, sl, sr = self._idx_sizes
+        self._idx_sizes = (sn + nodes, sl + links, sr + regions)
+
+    def add_node(self, node):
+        '''
+            Adds the node to the network
+        '''
+        self._check_index()
+        self.nodes.append(node)
+        self._node_idx.setdefault(node.nid, node)
+        self._grow_index(nodes=1)
+        self._paths_cache.clear()
+
+    def add_region(self, region):
+        '''
+            Adds the region to the network
+        '''
+        self._check_index()
+        self.regions.append(region)
+        self._region_idx.setdefault(region.code, region)
+        self._grow_index(regions=1)
+
     def contains_node(self, nid):
         '''
             Determines if the network contains a node with the specified id 
         '''
-        for n in self.nodes:
-            if n.nid == nid:
-                return True
-        return False
+        return self.get_node(nid) is not None
 
     def get_node(self, nid):
         '''
             Returns the first found node with the specified id
+            (the index is not rebuilt if a node was replaced in self.nodes: call reindex())
         '''
-        for n in self.nodes:
-            if n.nid == nid:
-                return n
-        return None
+        node = self._node_idx.get(nid)
+        if node is not None and node.nid != nid:
+            # node ids were changed in place
+            self.reindex()
+            node = self._node_idx.get(nid)
+        elif node is None:
+            self._check_index()
+            node = self._node_idx.get(nid)
+        return node
 
     def contains_region(self, code):
         '''
             Determines if the network contains a region with the specified code
         '''
-        for region in self.regions:
-            if region.code == code:
-                return True
-        return False
+        return self.get_region(code) is not None
 
     def get_region(self, code):
         '''
             Returns the first found region with the specified code
         '''
-        for region in self.regions:
-            if region.code == code:
-                return region
-        return None
+        region = self._region_idx.get(code)
+        if region is None:
+            self._check_index()
+            region = self._region_idx.get(code)
+        return region
 
     def contains_link(self, out_node, in_node):
         '''
             Checks if the net contains a link
         '''
-        for lnk in self.links:
-            if lnk.out_node is out_node and lnk.in_node is in_node:
-                return True
-        return False
+        return self.get_link(out_node, in_node) is not None
 
     def get_link(self, out_node, in_node):
         '''
             Returns the first found link with the specified out and in nodes
         '''
+        lnk = self._link_idx.get((out_node.nid, in_node.nid))
+        if lnk is None:
+            self._check_index()
+            lnk = self._link_idx.get((out_node.nid, in_node.nid))
+        if lnk is not None and lnk.out_node is out_node and lnk.in_node is in_node:
+            return lnk
         for lnk in out_node.out_links:
             if lnk.out_node is out_node and lnk.in_node is in_node:
                 return lnk
         return None
 
+    def _append_link(self, new_link):
+        self._check_index()
+        new_link.out_node.out_links.append(new_link)
+        new_link.in_node.in_links.append(new_link)
+        self.links.append(new_link)
+        self._link_idx.setdefault((new_link.out_node.nid, new_link.in_node.nid), new_link)
+        self._grow_index(links=1)
+        self._paths_cache.clear()
+
     def add_link(self, out_id, in_id, weight=0, directed=False):
         '''
             Adds a link with the specified characteristics
         '''
-        if self.contains_node(out_id):
-            # out-node is already in the net
-            out_node = self.get_node(out_id)
-            if self.contains_node(in_id):
-                # in-node is already in the net
-                in_node = self.get_node(in_id)
-                if self.contains_link(out_node, in_node):
-                    # out-node and in-node are already linked: change the link weight
-                    self.get_link(out_node, in_node).weight = weight
-                else:
-                    # there is no such a link in the net: add a new one
-                    new_link = Link(out_node, in_node, weight)
-                    out_node.out_links.append(new_link)
-                    in_node.in_links.append(new_link)
-                    self.links.append(new_link)
-            else:
-                # the net contains the specified out-node, but there is no in-node with the specified id
-                in_node = Node(in_id)
-                new_link = Link(out_node, in_node, weight)
-                out_node.out_links.append(new_link)
-                in_node.in_links.append(new_link)
-                self.nodes.append(in_node)
-                self.links.append(new_link)
-        else:
+        out_node = self.get_node(out_id)
+        in_node = self.get_node(in_id)
+        if in_node is None:
+            # there is no in-node with the specified id
+            in_node = Node(in_id)
+            self.add_node(in_node)
+        if out_node is None:
             # the net does not contain the specified out-node
             out_node = Node(out_id)
-            if self.contains_node(in_id):
-                # in-node is already in the net
-                in_node = self.get_node(in_id)
-            else:
-                # there are no in-node and out-node with the specified ids
-                in_node = Node(in_id)
-                self.nodes.append(in_node)
-            # create new link
-            new_link = Link(out_node, in_node, weight)
-            out_node.out_links.append(new_link)
-            in_node.in_links.append(new_link)
-            self.nodes.append(out_node)
-            self.links.append(new_link)
+            self.add_node(out_node)
+        lnk = self.get_link(out_node, in_node)
+        if lnk is not None:
+            # out-node and in-node are already linked: change the link weight
+            if lnk.weight != weight:
+                lnk.weight = weight
+                self._paths_cache.clear()
+        else:
+            # there is no such a link in the net: add a new one
+            self._append_link(Link(out_node, in_node, weight))
         # add the reverse link
         if not directed:
             self.add_link(in_id, out_id, weight, True)
@@ -143,28 +212,156 @@ class Net:
     @property
     def to_matrix(self):
         self.nodes.sort(key=lambda nd: nd.nid)  # sort the nodes!
-        mtx = np.array([[np.inf for _ in self.nodes] for __ in self.nodes])
-        for nd in self.nodes:
-            mtx[nd.nid][nd.nid] = 0
-        for lnk in self.links:
-            mtx[lnk.out_node.nid][lnk.in_node.nid] = lnk.weight
-        return mtx
+        return apsp.adjacency_matrix(len(self.nodes), self.links)
 
-    def floyd_warshall(self, nodes):
+    def floyd_warshall(self, nodes, dtype=None, cache=None, processes=None):
+        '''
+            Shortest distances between the given nodes (vectorized Floyd-Warshall)
+            dtype - np.float32 to halve the memory of the matrix
+            cache - SDMCache to reuse the matrix computed for the same network
+            processes - if set, the rows are computed by Dijkstra in parallel
+            by that many worker processes (see apsp.parallel_apsp)
+        '''
         nodes.sort(key=lambda nd: nd.nid)
-        # print([nd.nid for nd in nodes])
-        g = np.array([[np.inf for _ in nodes] for __ in nodes])
-        for nd in nodes:
-            g[nd.nid][nd.nid] = 0
-        for lnk in self.links:
-            g[lnk.out_node.nid][lnk.in_node.nid] = lnk.weight
-        for nk in nodes:
-            for ni in nodes:
-                for nj in nodes:
-                    dist = g[ni.nid][nk.nid] + g[nk.nid][nj.nid]
-                    if g[ni.nid][nj.nid] > dist:
-                        g[ni.nid][nj.nid] = dist
-        return g
+
+        def compute():
+            if processes is not None:
+                return apsp.parallel_apsp(apsp.csr_graph(len(nodes), self.links), processes, dtype)
+            g = apsp.adjacency_matrix(len(nodes), self.links)
+            return apsp.floyd_warshall(g, dtype=dtype)
+
+        if cache is not None and processes is not None:
+            # the workers fill the cache file in place
+            graph = apsp.csr_graph(len(nodes), self.links)
+            return cache.get(nodes, self.links, lambda path: apsp.parallel_apsp(graph, processes, cache.dtype, out=path),
+                             into=True)
+        if cache is not None:
+            return cache.get(nodes, self.links, compute)
+        return compute()
+
+    def contract_chains(self, nodes, keep=None):
+        '''
+            Contraction of the degree-2 chains of the given nodes (intersections)
+            keep - nids not to be contracted, demand_sources() by default
+            (the closest intersections of clients and loading points, inlets, outlets)
+        '''
+        if keep is None:
+            keep = self.demand_sources()
+        return Contraction(nodes, keep)
+
+    def contracted_sdm(self, nodes, keep=None, dtype=None, cache=None, processes=None):
+        '''
+            SDM calculated on the graph with contracted degree-2 chains
+            (indexed by the original nids, see ContractedSDM)
+            cache - SDMCache to reuse the matrix of the kept nodes computed for the same network
+            processes - if set, the matrix of the kept nodes is computed by Dijkstra in parallel
+            (see floyd_warshall)
+        '''
+        contraction = self.contract_chains(nodes, keep)
+
+        def compute():
+            if processes is not None:
+                return apsp.parallel_apsp(contraction.graph(), processes, dtype)
+            return contraction.floyd_warshall(dtype)
+
+        if cache is not None and processes is not None:
+            # the workers fill the cache file in place
+            d = cache.get(nodes, self.links,
+                          lambda path: apsp.parallel_apsp(contraction.graph(), processes, cache.dtype, out=path),
+                          variant=contraction.keep, into=True)
+            return ContractedSDM(d, contraction)
+        if cache is not None:
+            return ContractedSDM(cache.get(nodes, self.links, compute, variant=contraction.keep), contraction)
+        return ContractedSDM(compute(), contraction)
+
+    def build_hierarchy(self, nodes, max_settled=100):
+        '''
+            Contraction hierarchy of the links between the given nodes (intersections),
+            stored as self.ch to answer the distance queries without the full SDM
+        '''
+        nids = {nd.nid for nd in nodes}
+        links = [lnk for lnk in self.links if lnk.out_node.nid in nids and lnk.in_node.nid in nids]
+        self.ch = ContractionHierarchy(nodes, links, max_settled)
+        return self.ch
+
+    def update_link_weights(self, weights):
+        '''
+            Changes the weights of the links {(out_id, in_id): weight}
+            and repairs SDM incrementally (only the rows affected by the changes)
+        '''
+        changes = []
+        for (out_id, in_id), weight in weights.items():
+            out_node, in_node = self.get_node(out_id), self.get_node(in_id)
+            lnk = None if out_node is None or in_node is None else self.get_link(out_node, in_node)
+            if lnk is None:
+                raise KeyError("There is no link {} -> {} in the net".format(out_id, in_id))
+            if lnk.weight != weight:
+                changes.append((out_node.nid, in_node.nid, lnk.weight, weight))
+                lnk.weight = weight
+        if len(changes) == 0:
+            return
+        self._paths_cache.clear()
+        self.prepared = None
+        if self.ch is not None:
+            self.build_hierarchy([self.get_node(nid) for nid in self.ch.rank], self.ch.max_settled)
+        graph = apsp.csr_graph(len(self.sdm), self.links)
+        if isinstance(self.sdm, SourceSDM):
+            self.sdm.refresh(graph)
+            if self.graph is not None:
+                self.graph = graph
+        elif isinstance(self.sdm, ContractedSDM):
+            self.sdm = self.contracted_sdm(self.sdm.contraction.nodes, self.sdm.contraction.keep)
+        else:
+            if not self.sdm.flags.writeable:  # memory-mapped from the cache
+                self.sdm = np.array(self.sdm)
+            apsp.update_weights(self.sdm, graph, changes)
+
+    def demand_sources(self):
+        '''
+            Ids of the nodes whose rows of SDM are used for routing and simulation:
+            inlets, outlets and the closest intersections of clients and loading points
+        '''
+        sources = set()
+        for node in self.nodes:
+            if node.inlet or node.outlet:
+                sources.add(node.nid)
+            if node.type != 'N' and node.closest_itsc is not None:
+                sources.add(node.closest_itsc.nid)
+        return sorted(sources)
+
+    def source_sdm(self, nodes, sources=None, dtype=None, max_bytes=None):
+        '''
+            Shortest distances from the demand-relevant sources only
+            (multi-source Dijkstra on the sparse graph of the given nodes)
+            sources - node ids, demand_sources() by default
+            max_bytes - memory budget for the rows (other rows are computed on demand)
+        '''
+        graph = apsp.csr_graph(len(nodes), self.links)
+        if sources is None:
+            sources = self.demand_sources()
+        return SourceSDM(graph, sources, dtype, max_bytes)
+
+    def lazy_sdm(self, nodes, max_bytes=2 ** 30, dtype=None):
+        '''
+            SDM computing every row on its first access and keeping
+            the recently used rows within the memory budget
+        '''
+        return self.source_sdm(nodes, sources=[], dtype=dtype, max_bytes=max_bytes)
+
+    def sdm_block(self, sources, targets):
+        '''
+            Shortest distances len(sources) x len(targets) (node ids)
+            for any of the SDM representations
+        '''
+        targets = np.asarray(targets, dtype=np.int64)
+        if isinstance(self.sdm, np.ndarray):
+            return np.asarray(self.sdm[np.ix_(np.asarray(sources, dtype=np.int64), targets)], dtype=np.float64)
+        if isinstance(self.sdm, SourceSDM):
+            self.sdm.add_sources(sources)
+            return np.array([self.sdm.row(i)[targets] for i in sources], dtype=np.float64).reshape(-1, len(targets))
+        if isinstance(self.sdm, ContractedSDM):
+            return self.sdm.block(sources, targets)
+        return np.array([[self.sdm[i, j] for j in targets] for i in sources], dtype=np.float64).reshape(-1, len(targets))
 
     def gps_distance(self, node1, node2):
         ''' 
@@ -172,33 +369,60 @@ class Net:
         '''
         res = 0
         if (node1 is not None and node2 is not None):
-            lat1, lon1 = node1.x, node1.y
-            lat2, lon2 = node2.x, node2.y
-            Earth_radius = 6371  # km
-            dlat = math.radians(lat2 - lat1)
-            dlon = math.radians(lon2 - lon1)
-            a = (math.sin(0.5 * dlat) * math.sin(0.5 * dlat) + \
-                 math.cos(math.radians(lat1)) * \
-                 math.cos(math.radians(lat2)) * \
-                 math.sin(0.5 * dlon) * math.sin(0.5 * dlon))
-            res = round(2 * Earth_radius * \
-                        math.atan2(math.sqrt(a), math.sqrt(1 - a)), 3)
+            res = float(spatial.haversine(node1.x, node1.y, node2.x, node2.y, self.gps_decimals))
         return res
 
-    def gen_requests(self, sender=None, nodes=[], probs={}, s_weight=Stochastic(), s_dimensions=Stochastic()):
+    def gps_distances(self, items1, items2, matrix=False):
+        '''
+            Haversine distances between the nodes (or regions) as numpy array:
+            pairwise, from a single node to many or, if matrix, many-to-many
+        '''
+        return spatial.distances(items1, items2, matrix, self.gps_decimals)
+
+    def gen_scenarios(self, sender=None, nodes=[], probs={}, s_weight=Stochastic(), s_dimensions=Stochastic(),
+                      k=1, rng=None, antithetic=False, crn=False):
+        '''
+            Generates k demand scenarios at once: the node gets a request
+            with the probability of its type (probs: {type: probability}),
+            weights and dimensions are sampled in bulk
+            rng - numpy Generator or seed (a new unseeded generator by default)
+            crn - common random numbers: every node of every scenario gets its own uniform numbers
+            (request, weight, dimensions), so the runs with the same rng and other probs
+            or distributions stay paired
+            antithetic - scenarios 2i and 2i+1 use the numbers u and 1 - u (implies crn)
+        '''
+        rng = np.random.default_rng(rng)
+        types = {}
+        codes = np.fromiter((types.setdefault(node.type, len(types)) for node in nodes), dtype=np.int64,
+                            count=len(nodes))
+        p = np.array([probs[t] for t in types], dtype=np.float64)[codes]
+        if antithetic or crn:
+            half = -(-k // 2) if antithetic else k
+            u = rng.random((5, half, len(nodes)))  # request, weight, length, width, height
+            if antithetic:
+                pairs = np.empty((5, 2 * half, len(nodes)))
+                pairs[:, 0::2], pairs[:, 1::2] = u, 1 - u
+                u = pairs[:, :k]
+            mask = u[0] < p
+            scenario, destination = np.nonzero(mask)
+            weight = np.round(s_weight.quantile(u[1][mask]))
+            length, width, height = (np.round(s_dimensions.quantile(u[i][mask])) for i in (2, 3, 4))
+        else:
+            mask = rng.random((k, len(nodes))) < p
+            scenario, destination = np.nonzero(mask)
+            weight = np.round(s_weight.sample(len(scenario), rng))
+            length, width, height = np.round(s_dimensions.sample(3 * len(scenario), rng)).reshape(3, len(scenario))
+        return Scenarios(sender, nodes, k, scenario, destination, weight, length, width, height)
+
+    def gen_requests(self, sender=None, nodes=[], probs={}, s_weight=Stochastic(), s_dimensions=Stochastic(),
+                     rng=None):
         # self.demand = []
-        requests = []
-        for node in nodes:
-            if random.random() < probs[node.type]:
-                rqst = Request(weight=round(s_weight.value()), length=round(s_dimensions.value()),
-                               width=round(s_dimensions.value()), height=round(s_dimensions.value()), orgn=sender,
-                               dst=node)
-                requests.append(rqst)
+        requests = self.gen_scenarios(sender, nodes, probs, s_weight, s_dimensions, rng=rng).batch()
         print("Demand generation for {} completed: {} requests generated.".format(sender,
                                                                                   len(requests)))
-        self.demand.extend(requests)
+        self.demand = DemandBatch.concat([self.demand, requests])
 
-    def gen_demand(self, flows, probs, requests=None, s_weight=None, traditional=False):
+    def gen_demand(self, flows, probs, requests=None, s_weight=None, traditional=False, rng=None):
         '''
             Generates transport demand
             flows - incoming flows: {node_id: value}
@@ -206,160 +430,164 @@ class Net:
             requests
             s_weight
             traditional - if True, uses traditioinal (zone-based) approach to generate demand
+            rng - numpy Generator or seed for all the draws (destinations, origins and weights)
         '''
+        rng = np.random.default_rng(rng)
 
         clients = [nd for nd in self.nodes if nd.type != 'N' and nd.type != 'L']
         rcodes = [r.code for r in self.regions]
         _requests, reqs = [], []
         _total = sum(flows.values())  # total number of requests to generate
-        _odm = np.matrix([
-            [0 for r in self.regions]
-            for f in flows
-        ])
-        _srf = np.matrix([
-            [0.0 for r in self.regions]
-            for f in flows
-        ])
         _attrs = [[] for r in self.regions]
 
         # 1) generate set of _total requests with destinations according to provided probs
         if not requests:
-            generated = 0
-            while generated < _total:
-                dst = random.choice(clients)
-                if random.random() < probs[dst.type]:
-                    req = Request(0, None, dst)
-                    generated += 1
-                    reqs.append(req)
+            # random clients accepted with the probability of their type (in batches)
+            accept = np.array([probs[nd.type] for nd in clients], dtype=np.float64)
+            while len(reqs) < _total:
+                need = _total - len(reqs)
+                idx = rng.integers(0, len(clients), max(2 * need, 16))
+                idx = idx[rng.random(len(idx)) < accept[idx]][:need]
+                reqs.extend(Request(0, orgn=None, dst=clients[i]) for i in idx)
         else:
             reqs = requests
 
         # 2) choose origin (inlet) according to provided flows
 
         # 2.1) define probabilities for origins to be assigned to the requests
-        ps = {}  # { req: {inlet.nid: normalized(1/distance^2)} } probability
-        # { rgn: {inlet.nid: normalized(1/distance^2)} } part of requests for traditional
+        ps = None  # [req, inlet] normalized(1/distance^2) probability
+        _odm = None  # [inlet, region] number of requests for traditional
         if traditional:
             # calculate attractions for the set of generated requests
+            ridx = {code: j for j, code in enumerate(rcodes)}
             for req in reqs:
-                idx = rcodes.index(req.destination.region.code)
-                _attrs[idx].append(req)
-            # print([len(a) for a in _attrs], sum([len(a) for a in _attrs]), 'attrs')
-            # calculate space resistance function
-            for f in flows.keys():
-                for r in rcodes:
-                    orgn = self.nodes[f]
-                    dst = self.get_region(r)
-                    i, j = list(flows.keys()).index(f), rcodes.index(r)
-                    _srf[i, j] = 1 / self.gps_distance(orgn, dst) ** 2
-                    # _srf[i, j] = 1.0
-            # print(_srf)
-            # calculate ODM by using gravitation model
-            # denoms = [sum([len(_attrs[j]) * _srf[i, j] for j in range(len(self.regions))]) 
-            #           for i in range(len(flows))]
-            denoms = [sum([flows[list(flows.keys())[i]] * _srf[i, j] for i in range(len(flows))])
-                      for j in range(len(self.regions))]
-            # print(denoms)
-            for f in flows.keys():
-                for r in rcodes:
-                    i, j = list(flows.keys()).index(f), rcodes.index(r)
-                    _odm[i, j] = round(_srf[i, j] * len(_attrs[j]) * flows[f] / denoms[j])
-            # print(_odm, _odm.sum())
-            # print([_odm[i,:].sum() for i in range(_odm.shape[0])],
-            #        sum([_odm[i,:].sum() for i in range(_odm.shape[0])]), 'prods')
-            # print([_odm[:,i].sum() for i in range(_odm.shape[1])],
-            #        sum([_odm[:,i].sum() for i in range(_odm.shape[1])]), 'attrs')
+                _attrs[ridx[req.destination.region.code]].append(req)
+            attrs = np.array([len(a) for a in _attrs], dtype=np.float64)
+            # calculate space resistance function (inlets x regions)
+            orgns = [self.nodes[f] for f in flows.keys()]
+            dsts = [self.get_region(r) for r in rcodes]
+            _srf = 1 / self.gps_distances(orgns, dsts, matrix=True) ** 2
+            # calculate ODM by using gravitation model (normalized by the columns)
+            prods = np.array(list(flows.values()), dtype=np.float64)
+            denoms = prods @ _srf
+            _odm = np.round(_srf * attrs[None, :] * prods[:, None] / denoms[None, :]).astype(np.int64)
         else:
-            for req in reqs:
-                ds = {}
-                dest = req.destination.closest_itsc
-                for f in flows.keys():
-                    orgn = self.nodes[f]
-                    ds[f] = self.sdm[orgn.nid, dest.nid] + self.gps_distance(dest, req.destination)
-                sum_p = sum([1 / d ** 2 for d in ds.values()])
-                for f in ds.keys():
-                    ds[f] = (1 / ds[f] ** 2) / sum_p
-                ps[req] = ds
+            # distances from the closest intersections to the clients
+            dcls = self.gps_distances([req.destination.closest_itsc for req in reqs],
+                                      [req.destination for req in reqs])
+            # matrix of probabilities: requests x inlets
+            dests = [req.destination.closest_itsc.nid for req in reqs]
+            ds = self.sdm_block([self.nodes[f].nid for f in flows.keys()], dests).T + np.reshape(dcls, (-1, 1))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ps = 1 / ds ** 2
+                ps /= ps.sum(axis=1, keepdims=True)
 
         # 2.2) assign origins
         if traditional:
-            for f in flows.keys():
-                for r in rcodes:
-                    i, j = list(flows.keys()).index(f), rcodes.index(r)
-                    assigned, empty = 0, len(_attrs[j]) == 0
-                    while assigned < _odm[i, j] and not empty:
-                        req = random.choice(_attrs[j])
-                        _attrs[j].remove(req)
-                        req.origin = self.get_node(f)
+            # requests of every region in random order, taken by the inlets in turn
+            for j in range(len(rcodes)):
+                _attrs[j] = [_attrs[j][k] for k in rng.permutation(len(_attrs[j]))]
+            taken = np.minimum(np.cumsum(_odm, axis=0), [len(a) for a in _attrs])
+            starts = np.vstack((np.zeros((1, len(rcodes)), dtype=np.int64), taken[:-1]))
+            for i, f in enumerate(flows.keys()):
+                origin = self.get_node(f)
+                for j in range(len(rcodes)):
+                    for req in _attrs[j][starts[i, j]:taken[i, j]]:
+                        req.origin = origin
                         _requests.append(req)
-                        assigned += 1
-                        empty = len(_attrs[j]) == 0
-                        # print(i, j, _odm[i, j], assigned)
         else:  # proposed
-            for f in flows.keys():
-                assigned = 0
-                while assigned < flows[f]:
-                    req = random.choice(reqs)
-                    inlet_nid = self.roulette(ps[req])
-                    if f == inlet_nid:
-                        reqs.remove(req)
-                        req.origin = self.get_node(f)
-                        _requests.append(req)
-                        assigned += 1
+            # every inlet in turn draws its flow from the free requests
+            # with the probabilities ps[:, inlet] (weighted sampling without replacement
+            # by the Gumbel top-k keys: the same as the repeated roulette with rejection)
+            free = np.ones(len(reqs), dtype=bool)
+            for j, f in enumerate(flows.keys()):
+                with np.errstate(divide='ignore'):
+                    keys = np.log(ps[:, j]) - np.log(-np.log(rng.random(len(reqs))))
+                keys[~free | np.isnan(keys)] = -np.inf
+                k = min(flows[f], np.count_nonzero(np.isfinite(keys)))
+                if k == 0:
+                    continue
+                chosen = np.argpartition(-keys, k - 1)[:k]
+                chosen = chosen[np.argsort(-keys[chosen])]
+                free[chosen] = False
+                origin = self.get_node(f)
+                for i in chosen:
+                    reqs[i].origin = origin
+                    _requests.append(reqs[i])
 
         # 2.3) generate consingment weight (for routing procedure)
         # TODO: depends on the client's type?
-        for req in _requests:
-            req.weight = s_weight.value()
+        for req, weight in zip(_requests, s_weight.sample(len(_requests), rng).tolist()):
+            req.weight = weight
 
         return _requests
 
-    def roulette(self, probs):
+    def roulette(self, probs, rng=None):
         '''
             Select random key according to the probability (given as value)
-            probs = {key: prob}, such that sum(probs.values()) == 1
-            TODO: recalculate prob values to sum(values) == 1 (normalize probabilities)
-        '''
-        p, cums = 0, []
-        for key in probs.keys():
-            p += probs[key]
-            cums.append(p)
-        r = random.random()
-        for i in range(len(cums)):
-            if r < cums[i]:
-                return list(probs.keys())[i]
+            probs = {key: prob} (normalized to sum(values) == 1)
+            Draws from the alias table of probs (built once for the same probs, O(1) per draw)
+            rng - numpy Generator (random module by default)
+        '''
+        table = _alias_table(tuple(probs.items()))
+        if rng is None:
+            return table.draw()
+        return table.keys[table.sample(1, rng)[0]]
 
     def dijkstra(self, source):
         '''
-            Dijkstra's algorithm to calculate the shortest paths
+            Dijkstra's algorithm (with binary heap) to calculate the shortest paths
             from the given source to all other nodes in the network
         '''
         size = len(self.nodes)
         distance = [np.inf for _ in range(size)]
         previous = [None for _ in range(size)]
-        q = self.nodes[:]
         distance[source.nid] = 0
+        q = [(0, 0, source)]  # (distance, counter, node)
+        counter = 1
         while len(q) > 0:
-            u = q[0]
-            min_distance = distance[u.nid]
-            for nd in q:
-                if distance[nd.nid] < min_distance:
-                    u = nd
-                    min_distance = distance[u.nid]
-            q.remove(u)
-            neighbors = [lnk.in_node for lnk in u.out_links]
-            for v in neighbors:
-                alt = distance[u.nid] + self.get_link(u, v).weight
+            d, _, u = heapq.heappop(q)
+            if d > distance[u.nid]:
+                continue  # outdated entry of the queue
+            for lnk in u.out_links:
+                v = lnk.in_node
+                alt = d + lnk.weight
                 if alt < distance[v.nid]:
                     distance[v.nid] = alt
                     previous[v.nid] = u
+                    heapq.heappush(q, (alt, counter, v))
+                    counter += 1
         return previous
 
+    def shortest_tree(self, source):
+        '''
+            Shortest path tree (previous nodes) from the source,
+            stored in the LRU cache of the net
+        '''
+        previous = self._paths_cache.get(source.nid)
+        if previous is not None:
+            self.paths_cache_hits += 1
+            self._paths_cache.move_to_end(source.nid)
+            return previous
+        self.paths_cache_misses += 1
+        previous = self.dijkstra(source)
+        self._paths_cache[source.nid] = previous
+        if len(self._paths_cache) > self.paths_cache_size:
+            self._paths_cache.popitem(last=False)
+        return previous
+
+    def paths_cache_info(self):
+        '''
+            Statistics of the shortest path trees cache
+        '''
+        return {'hits': self.paths_cache_hits, 'misses': self.paths_cache_misses,
+                'size': len(self._paths_cache), 'maxsize': self.paths_cache_size}
+
     def define_path(self, source, target):
         '''
             Retrieve path defined by Dijkstra's algorithm
         '''
-        previous = self.dijkstra(source)
+        previous = self.shortest_tree(source)
         u = target
         path = []
         while previous[u.nid] is not None:
@@ -418,7 +646,7 @@ class Net:
         for i in range(n):
             if combined_weights[i] > 0:
                 combined.append(Request(combined_weights[i],
-                                        sender, self.get_node(i)))
+                                        orgn=sender, dst=self.get_node(i)))
                 consignee_ids.append(i)
         if verbose: print(sender_id, consignee_ids)
         # number of consignees
@@ -518,9 +746,11 @@ class Net:
             od[(rqst.origin.nid, rqst.destination.nid)] += 1
         return od
 
-    def load_from_file(self, fnodes='nodes.txt', flinks='links.txt', dlm='\t'):
+    def load_from_file(self, fnodes='nodes.txt', flinks='links.txt', dlm='\t', sparse=False):
         '''
             Load the net data (vertices and edges) from file
+            sparse - if True, SDM is calculated for the demand-relevant sources only
+            and the adjacency is kept as the CSR matrix in graph (mtx is None)
         '''
         # load nodes
         nodes = []
@@ -530,7 +760,7 @@ class Net:
             node = Node(nid=int(data[0]), name=data[1])
             node.type = data[2].strip()
             node.x, node.y = float(data[3]), float(data[4])
-            self.nodes.append(node)
+            self.add_node(node)
             if node.type == 'N':
                 reg_code = int(data[5])
                 region = None
@@ -539,7 +769,7 @@ class Net:
                 else:
                     reg_name = 'Zone ' + str(reg_code + 1)
                     region = Region(code=reg_code, name=reg_name)
-                    self.regions.append(region)
+                    self.add_region(region)
                 region.nodes.append(node)
                 node.region = region
                 node.inlet = data[6] == '1'
@@ -549,53 +779,55 @@ class Net:
         self.set_regions()
         self.nodes.sort(key=lambda nd: nd.nid)
         # load links
+        pairs = []
         f = open(flinks, 'r')
         for data_line in f:
             data = data_line.split(dlm)
-            nid1, nid2 = int(data[1]), int(data[2])
-            dist = 0
-            if self.contains_node(nid1) and self.contains_node(nid2):
-                dist = self.gps_distance(self.get_node(nid1), self.get_node(nid2))
-            self.add_link(nid1, nid2, dist)
+            pairs.append((int(data[1]), int(data[2])))
         f.close()
+        # link lengths for the known nodes (in one vectorized call)
+        ends = [(self.get_node(nid1), self.get_node(nid2)) for nid1, nid2 in pairs]
+        known = [i for i, (nd1, nd2) in enumerate(ends) if nd1 is not None and nd2 is not None]
+        dists = np.zeros(len(pairs))
+        if len(known) > 0:
+            dists[known] = self.gps_distances([ends[i][0] for i in known], [ends[i][1] for i in known])
+        for (nid1, nid2), dist in zip(pairs, dists):
+            self.add_link(nid1, nid2, float(dist))
         # set iternal variables
-        self.mtx = self.to_matrix
-        self.sdm = self.floyd_warshall(nodes)
+        if sparse:
+            self.sdm = self.source_sdm(nodes)
+            self.graph = self.sdm.graph
+            self.mtx = None
+        else:
+            self.mtx = self.to_matrix
+            self.sdm = self.floyd_warshall(nodes)
 
     def auto_regions(self, inlets):
         self.regions = []  # reset
+        self.reindex()
         # define zones - one per each inlet
         zones = list(range(len(inlets)))
         for z in zones:
             reg_name = 'Zone ' + str(z + 1)
             region = Region(code=z, name=reg_name)
-            self.regions.append(region)
+            self.add_region(region)
         #
         itscs = [node for node in self.nodes if node.type == 'N']  # intersections
         inodes = [self.get_node(inlet) for inlet in inlets]  # inlet nodes
-        for itsc in itscs:
-            # get closest inlet
-            closest, dist = None, float('inf')
-            for z in zones:
-                d = self.gps_distance(inodes[z], itsc)  # get sdm distance?
-                if d < dist:
-                    dist = d
-                    closest = z
-            itsc.region = self.get_region(closest)
+        # get closest inlet (get sdm distance?)
+        closest = SpatialIndex(inodes).nearest(itscs)
+        zone_of = {id(inode): z for z, inode in reversed(list(enumerate(inodes)))}
+        for itsc, inode in zip(itscs, closest):
+            itsc.region = self.get_region(zone_of[id(inode)])
 
     def set_regions(self):
-        itscs = [node for node in self.nodes if node.type == 'N']
         for node in self.nodes:
-            closest, dist = node, float('inf')
-            if not node in itscs:
-                for itsc in itscs:
-                    d = self.gps_distance(node, itsc)
-                    if d < dist:
-                        dist = d
-                        closest = itsc
-            node.closest_itsc = closest
-            node.region = closest.region
-            if not node in itscs:
+            if node.type == 'N':
+                node.closest_itsc = node
+        self.set_closest_itsc()
+        for node in self.nodes:
+            node.region = node.closest_itsc.region
+            if node.type != 'N':
                 node.region.nodes.append(node)
         # define centroids
         for region in self.regions:
@@ -620,12 +852,13 @@ class Net:
                     lp = self.get_node(loadpoint)
                     if lp is not None:
                         lps.append(lp)
+                # distances from the closest intersections to the loadpoints
+                lcls = self.gps_distances([lp.closest_itsc for lp in lps], lps)
                 # determine distance to closest loadpoints (direct and back)
                 for req in rs:
                     # choose the closest loadpoint
                     lds = {}
-                    for lp in lps:
-                        lcl = self.gps_distance(lp.closest_itsc, lp)
+                    for lp, lcl in zip(lps, lcls):
                         ld = self.sdm[req.origin.closest_itsc.nid][lp.closest_itsc.nid]
                         lds[lp] = 2 * lcl + ld
                     closest = min(lds, key=lds.get)
@@ -640,9 +873,10 @@ class Net:
                     ds.append(direct + back)
                     # print(closest, direct, back)
             else:  # deliveries to clients
-                for req in rs:
-                    # distance from the closest intersection to client
-                    dcl = self.gps_distance(req.destination.closest_itsc, req.destination)
+                # distances from the closest intersections to clients
+                dcls = self.gps_distances([req.destination.closest_itsc for req in rs],
+                                          [req.destination for req in rs])
+                for req, dcl in zip(rs, dcls):
                     # distance from entry to the client's closest intersection
                     direct = self.sdm[req.origin.closest_itsc.nid][req.destination.closest_itsc.nid]
                     # choose the closest outlet
@@ -671,17 +905,21 @@ class Net:
             # deliveries only by conventional vehicles
             return distances(reqs), []
 
-    def set_closest_itsc(self):
-        itscs = [node for node in self.nodes if node.type == 'N']
-        for node in self.nodes:
-            closest, dist = node, float('inf')
-            if not node in itscs:
-                for itsc in itscs:
-                    d = self.gps_distance(node, itsc)
-                    if d < dist:
-                        dist = d
-                        closest = itsc
-                node.closest_itsc = closest
+    def set_closest_itsc(self, index=None):
+        '''
+            Snaps every non-intersection node to the closest intersection
+            (one batched query to the spatial index of the intersections)
+            index - SpatialIndex of the intersections to reuse
+        '''
+        if index is None:
+            index = SpatialIndex([node for node in self.nodes if node.type == 'N'])
+        others = [node for node in self.nodes if node.type != 'N']
+        if len(index) == 0:
+            for node in others:
+                node.closest_itsc = node
+            return
+        for node, closest in zip(others, index.nearest(others)):
+            node.closest_itsc = closest
 
 
 class AreaBoundingBox:
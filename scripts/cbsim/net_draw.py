@@ -278,7 +278,7 @@ def select_loading_point(net):
         load_point.x = coordinates[0]['longitude']
         load_point.y = coordinates[0]['latitude']
         load_point.type = 'L'
-        net.nodes.append(load_point)
+        net.add_node(load_point)
         draw_results(net)
 
         refresh()
@@ -315,7 +315,7 @@ def select_loading_point(net):
         load_point.x = coordinates[0]['longitude']
         load_point.y = coordinates[0]['latitude']
         load_point.type = 'L'
-        net.nodes.append(load_point)
+        net.add_node(load_point)
         draw_results(net)
 
         refresh()
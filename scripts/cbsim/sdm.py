@@ -0,0 +1,205 @@
+import os, hashlib
+from collections import OrderedDict
+import numpy as np
+
+from scripts.cbsim import apsp
+
+
+class SourceSDM:
+    '''
+        Shortest distances matrix stored only for the selected source nodes
+        (rows are computed by the multi-source Dijkstra on the sparse graph)
+        Supports the same access pattern as the dense matrix: sdm[i][j], sdm[i, j];
+        the row of a node outside the source set is computed on the first access
+        max_bytes - memory budget for the rows: the least recently used rows
+        are evicted above it (None - unbounded)
+    '''
+
+    def __init__(self, graph, sources=(), dtype=None, max_bytes=None):
+        self.graph = graph  # CSR adjacency matrix
+        self.dtype = np.dtype(dtype or np.float64)
+        self.max_bytes = max_bytes
+        self.rows = OrderedDict()  # {source nid: distances row}, the least recently used first
+        self.nbytes = 0
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.add_sources(sources)
+
+    def __repr__(self):
+        return "SourceSDM({} x {}, {} rows, {} bytes)".format(*self.shape, len(self.rows), self.nbytes)
+
+    @property
+    def shape(self):
+        return self.graph.shape
+
+    def __len__(self):
+        return self.graph.shape[0]
+
+    def stats(self):
+        '''
+            Statistics of the rows cache (to size the memory budget)
+        '''
+        accesses = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / accesses if accesses > 0 else 0.0,
+                'rows': len(self.rows), 'nbytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+    def add_sources(self, sources):
+        '''
+            Computes (in one batch) the rows for the sources not calculated yet
+        '''
+        missing = sorted(set(int(s) for s in sources) - self.rows.keys())
+        if len(missing) > 0:
+            dists = apsp.multi_source_dijkstra(self.graph, missing, self.dtype)
+            for i, source in enumerate(missing):
+                self.rows[source] = dists[i].copy() if self.max_bytes is not None else dists[i]
+                self.nbytes += dists[i].nbytes
+            self.evict()
+
+    def evict(self):
+        '''
+            Drops the least recently used rows above the memory budget
+        '''
+        if self.max_bytes is None:
+            return
+        while self.nbytes > self.max_bytes and len(self.rows) > 1:
+            _, row = self.rows.popitem(last=False)
+            self.nbytes -= row.nbytes
+            self.evictions += 1
+
+    def refresh(self, graph):
+        '''
+            Recomputes the stored rows for the changed graph
+        '''
+        sources = list(self.rows.keys())
+        self.graph = graph
+        self.rows = OrderedDict()
+        self.nbytes = 0
+        self.add_sources(sources)
+
+    def row(self, i):
+        '''
+            Returns the shortest distances from node i to all nodes
+        '''
+        i = int(i)
+        row = self.rows.get(i)
+        if row is None:
+            self.misses += 1
+            self.add_sources([i])
+            return self.rows[i]
+        self.hits += 1
+        self.rows.move_to_end(i)
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            i, j = key
+            return self.row(i)[j]
+        return self.row(key)
+
+
+def fingerprint(nodes, links, variant=None):
+    '''
+        Hash of the network: ids and coordinates of the nodes, link ends and weights
+        variant - ids telling apart the matrices of the same network (e.g. the nids kept by the contraction)
+    '''
+    nodes = sorted(nodes, key=lambda nd: nd.nid)
+    h = hashlib.sha1()
+    h.update(np.array([nd.nid for nd in nodes], dtype=np.int64).tobytes())
+    h.update(np.array([(nd.x, nd.y) for nd in nodes], dtype=np.float64).tobytes())
+    for arr in apsp.link_arrays(links):
+        h.update(arr.tobytes())
+    if variant is not None:
+        h.update(b'variant')
+        h.update(np.asarray(variant, dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+class SDMCache:
+    '''
+        On-disk cache of the shortest distances matrices (.npy files keyed by the network fingerprint)
+        Hits are memory-mapped read-only; the least recently used files are evicted
+        when the directory exceeds max_bytes
+    '''
+
+    def __init__(self, path='results/sdm_cache', max_bytes=2 ** 32, dtype=np.float32):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    def __repr__(self):
+        return "SDMCache({}: {} files, {} bytes)".format(self.path, len(self.files()), self.size)
+
+    def file_name(self, key):
+        return os.path.join(self.path, key + '.npy')
+
+    def files(self):
+        return [os.path.join(self.path, f) for f in os.listdir(self.path) if f.endswith('.npy')]
+
+    @property
+    def size(self):
+        return sum(os.path.getsize(f) for f in self.files())
+
+    def load(self, key):
+        '''
+            Returns the memory-mapped matrix or None if there is no such key
+        '''
+        fname = self.file_name(key)
+        if not os.path.isfile(fname):
+            return None
+        os.utime(fname)  # mark as recently used
+        return np.load(fname, mmap_mode='r')
+
+    def save(self, key, sdm):
+        '''
+            Stores the matrix and evicts the least recently used ones above the size limit
+        '''
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                np.save(f, np.asarray(sdm, dtype=self.dtype))
+
+        self.save_into(key, write)
+
+    def save_into(self, key, write):
+        '''
+            Stores the matrix written by write(path) into the .npy file (of self.dtype) itself
+            (e.g. filled in place by the workers of apsp.parallel_apsp, no copy in memory)
+        '''
+        fname = self.file_name(key)
+        tmp = fname + '.tmp'
+        write(tmp)
+        os.replace(tmp, fname)
+        self.evict(keep=fname)
+
+    def evict(self, keep=None):
+        files = sorted(self.files(), key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in files)
+        for f in files:
+            if total <= self.max_bytes:
+                break
+            if f != keep:
+                total -= os.path.getsize(f)
+                os.remove(f)
+
+    def get(self, nodes, links, compute, variant=None, into=False):
+        '''
+            Returns the cached matrix for the network or computes (by compute()) and stores it
+            variant - see fingerprint
+            into - compute(path) writes the matrix into the file itself (see save_into)
+        '''
+        key = fingerprint(nodes, links, variant)
+        sdm = self.load(key)
+        if sdm is not None:
+            self.hits += 1
+            return sdm
+        self.misses += 1
+        if into:
+            self.save_into(key, compute)
+        else:
+            self.save(key, compute())
+        return self.load(key)
@@ -0,0 +1,87 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+Earth_radius = 6371  # km
+
+
+def haversine(lat1, lon1, lat2, lon2, decimals=3):
+    '''
+        Haversine formula for the arrays of coordinates [deg] broadcast by numpy:
+        pairwise (equal shapes), one-to-many (scalar and array)
+        or many-to-many (column and row arrays)
+        decimals - rounding of the distances [km], None for the full precision
+    '''
+    lat1, lon1 = np.asarray(lat1, dtype=np.float64), np.asarray(lon1, dtype=np.float64)
+    lat2, lon2 = np.asarray(lat2, dtype=np.float64), np.asarray(lon2, dtype=np.float64)
+    dlat = np.radians(lat2 - lat1)
+    dlon = np.radians(lon2 - lon1)
+    a = np.sin(0.5 * dlat) ** 2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(0.5 * dlon) ** 2
+    res = 2 * Earth_radius * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return res if decimals is None else np.round(res, decimals)
+
+
+def coordinates(items):
+    '''
+        Arrays of x (latitude) and y (longitude) of the nodes or regions
+    '''
+    return (np.fromiter((it.x for it in items), dtype=np.float64, count=len(items)),
+            np.fromiter((it.y for it in items), dtype=np.float64, count=len(items)))
+
+
+def distances(items1, items2, matrix=False, decimals=3):
+    '''
+        Haversine distances [km] between the nodes (or regions):
+        items1[i] -> items2[i] (pairwise), or items1[i] -> items2[j] if matrix,
+        or from a single node to the list of items2
+        decimals - rounding of the distances, None for the full precision
+    '''
+    x2, y2 = coordinates(items2)
+    if not isinstance(items1, (list, tuple)):
+        return haversine(items1.x, items1.y, x2, y2, decimals)
+    x1, y1 = coordinates(items1)
+    if matrix:
+        return haversine(x1[:, None], y1[:, None], x2[None, :], y2[None, :], decimals)
+    return haversine(x1, y1, x2, y2, decimals)
+
+
+def to_cartesian(lat, lon):
+    '''
+        Points on the unit sphere for the given coordinates (in degrees):
+        the chord between two points is monotonous in the haversine distance
+    '''
+    lat, lon = np.radians(np.asarray(lat, dtype=np.float64)), np.radians(np.asarray(lon, dtype=np.float64))
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+class SpatialIndex:
+    '''
+        KD-tree over the node coordinates (x - latitude, y - longitude as in Net.gps_distance)
+        Answers batched nearest-node queries with the exact haversine ordering
+    '''
+
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+        self.tree = None
+        if len(self.nodes) > 0:
+            self.tree = cKDTree(to_cartesian([nd.x for nd in self.nodes], [nd.y for nd in self.nodes]))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def query(self, lat, lon, k=1):
+        '''
+            Positions of the k nearest indexed nodes and the distances to them [km]
+            for the arrays of coordinates
+        '''
+        chords, idx = self.tree.query(to_cartesian(lat, lon), k=k)
+        return 2 * Earth_radius * np.arcsin(np.minimum(chords / 2, 1.0)), idx
+
+    def nearest(self, nodes):
+        '''
+            The nearest indexed node for every given node (one batched query)
+        '''
+        nodes = list(nodes)
+        if len(nodes) == 0 or self.tree is None:
+            return [None for _ in nodes]
+        _, idx = self.query([nd.x for nd in nodes], [nd.y for nd in nodes])
+        return [self.nodes[i] for i in idx]
@@ -1,4 +1,6 @@
 import math, random
+import numpy as np
+from scipy.special import ndtr, ndtri
 
 class Stochastic:
     '''
@@ -6,7 +8,8 @@ class Stochastic:
         Attributes: 
             law - code: 0 - uniform, 1 - gauss, 2 - exponential or rectangular by default, 
             distribution characteristics: location, scale, shape
-        Method: value - generates random variables with specified distibution
+        Methods: value - generates random variables with specified distibution,
+            quantile - inverse CDF, sample - array of the random variables (numpy generator)
     '''
 
     def __init__(self, law=0, location=0, scale=1, shape=0):
@@ -41,4 +44,84 @@ class Stochastic:
             return -self.scale * math.log(r)
         else:
             # rectangular distribution by default
-            return random.uniform(self.location, self.location + self.scale)
\ No newline at end of file
+            return random.uniform(self.location, self.location + self.scale)
+
+    def quantile(self, u):
+        '''
+            Inverse CDF: values for the array of uniform numbers u in [0, 1)
+            (monotonous in u, so u and 1 - u give the antithetic values)
+            The normal distribution is truncated to positive values
+        '''
+        u = np.asarray(u, dtype=np.float64)
+        if self.law == 1:
+            if self.scale <= 0:
+                return np.full(u.shape, float(self.location))
+            # Z > -location/scale: -Z is below location/scale, i.e. -Z = ndtri(v * ndtr(location/scale)), v in (0, 1]
+            # (accurate even if the positive part is far in the tail)
+            return self.location - self.scale * ndtri((1 - u) * ndtr(self.location / self.scale))
+        elif self.law == 2:
+            # exponential distribution
+            return -self.scale * np.log1p(-u)
+        else:
+            # rectangular distribution (by default)
+            return self.location + self.scale * u
+
+    def sample(self, n, rng=None):
+        '''
+            Returns the array of n generated values (n may be a shape)
+            by the inverse CDF (no rejection loop)
+            rng - numpy Generator or seed (a new unseeded generator by default)
+        '''
+        rng = np.random.default_rng(rng)
+        return self.quantile(rng.random(n))
+
+
+def seed_streams(seed=None, count=1):
+    '''
+        Independent seed sequences (e.g. per worker) spawned from the root seed;
+        np.random.default_rng(stream) gives the generator, stream.spawn(k) - the sub-streams
+        (per replication), so the same seed reproduces the same numbers for every worker
+        seed - None for the fresh entropy (see seed_streams(...)[0].entropy)
+    '''
+    return np.random.SeedSequence(seed).spawn(count)
+
+
+class AliasTable:
+    '''
+        Walker's alias table of the discrete distribution {key: prob}
+        (O(n) construction, O(1) per draw; the probabilities are normalized)
+    '''
+
+    def __init__(self, probs):
+        self.keys = list(probs.keys())
+        p = np.array([probs[key] for key in self.keys], dtype=np.float64)
+        n = len(p)
+        scaled = p * n / p.sum()
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while len(small) > 0 and len(large) > 0:
+            s, g = small.pop(), large.pop()
+            self.prob[s], self.alias[s] = scaled[s], g
+            scaled[g] -= 1 - scaled[s]
+            (small if scaled[g] < 1 else large).append(g)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def draw(self):
+        '''
+            Returns the random key (random module, as Net.roulette)
+        '''
+        i = random.randrange(len(self.keys))
+        return self.keys[i] if random.random() < self.prob[i] else self.keys[self.alias[i]]
+
+    def sample(self, n, rng=None):
+        '''
+            Returns the array of n positions of the random keys in self.keys
+            rng - numpy Generator or seed
+        '''
+        rng = np.random.default_rng(rng)
+        i = rng.integers(0, len(self.keys), n)
+        return np.where(rng.random(n) < self.prob[i], i, self.alias[i])
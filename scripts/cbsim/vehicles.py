@@ -5,6 +5,8 @@ class Vehicles:
 
     def __init__(self, vehicle_data):
         self.count = 0
+        self.min_count = 0  # lower bound of the vehicles needed (see fleet.lower_bound)
+        self.max_count = 0  # vehicles enough for a feasible solution (see fleet.upper_bound)
         self.capacity = vehicle_data["vehicle_capacity"]
         self.cargo_length = vehicle_data["cargo_length"]
         self.cargo_width = vehicle_data["cargo_width"]
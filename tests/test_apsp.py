@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+
+from scripts.cbsim import apsp
+from scripts.cbsim.net import Net
+from scripts.cbsim.node import Node
+
+
+def random_graph(rng, size=30, density=0.15):
+    # integer weights, so the distances are exact whatever the order of the additions
+    g = np.where(rng.random((size, size)) < density, rng.integers(1, 20, (size, size)), np.inf)
+    np.fill_diagonal(g, 0)
+    return g
+
+
+def csr(g):
+    outs, ins = np.nonzero(np.isfinite(g) & (g > 0))
+    return csr_matrix((g[outs, ins], (outs, ins)), shape=g.shape)
+
+
+def random_changes(rng, g, count, factors):
+    outs, ins = np.nonzero(np.isfinite(g) & (g > 0))
+    new = g.copy()
+    changes = []
+    for i in rng.choice(len(outs), size=min(count, len(outs)), replace=False):
+        u, v = outs[i], ins[i]
+        new[u, v] = max(1.0, np.round(g[u, v] * rng.choice(factors)))
+        changes.append((u, v, g[u, v], new[u, v]))
+    return new, changes
+
+
+@pytest.mark.parametrize('factors', [(2.0, 5.0, 10.0), (0.1, 0.5), (0.1, 0.5, 2.0, 10.0)],
+                         ids=['increases', 'decreases', 'mixed'])
+@pytest.mark.parametrize('seed', range(10))
+def test_update_weights_equals_full_recompute(seed, factors):
+    rng = np.random.default_rng(seed)
+    g = random_graph(rng)
+    d = apsp.floyd_warshall(g)
+    new, changes = random_changes(rng, g, 5, factors)
+    updated = apsp.update_weights(d, csr(new), changes)
+    assert np.array_equal(updated, apsp.floyd_warshall(new))
+
+
+def random_net(rng, size=25, count=60):
+    n = Net()
+    for nid in range(size):
+        node = Node(nid=nid)
+        node.x, node.y = 50.0 + rng.random() / 100, 19.9 + rng.random() / 100
+        node.type = 'N'
+        n.add_node(node)
+    for nid in range(1, size):  # connected
+        n.add_link(int(rng.integers(nid)), nid, float(rng.integers(1, 20)))
+    for _ in range(count):
+        u, v = rng.choice(size, 2, replace=False)
+        if n.get_link(n.get_node(int(u)), n.get_node(int(v))) is None:
+            n.add_link(int(u), int(v), float(rng.integers(1, 20)), directed=True)
+    return n
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_update_link_weights_of_memory_mapped_sdm(seed, tmp_path):
+    rng = np.random.default_rng(seed)
+    n = random_net(rng)
+    original = n.floyd_warshall(n.nodes)
+    np.save(tmp_path / 'sdm.npy', original)
+    n.sdm = np.load(tmp_path / 'sdm.npy', mmap_mode='r')  # read-only, as loaded by SDMCache
+    links = rng.choice(len(n.links), size=6, replace=False)
+    weights = {(n.links[i].out_node.nid, n.links[i].in_node.nid): n.links[i].weight * f
+               for i, f in zip(links, rng.choice([0.5, 2.0, 10.0], size=len(links)))}
+    n.update_link_weights(weights)
+    assert np.array_equal(n.sdm, n.floyd_warshall(n.nodes))
+    assert np.array_equal(np.load(tmp_path / 'sdm.npy'), original)  # the cached matrix is not changed